@@ -0,0 +1,157 @@
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+from sqlalchemy import select, and_, case
+from sqlalchemy.orm import aliased
+from database import GameParticipant, GameParticipantDetail, GameTeam
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PING_COLUMNS = [
+    'allInPings', 'assistMePings', 'basicPings', 'commandPings',
+    'dangerPings', 'enemyMissingPings', 'enemyVisionPings',
+    'getBackPings', 'holdPings', 'needVisionPings', 'onMyWayPings',
+    'pushPings', 'retreatPings', 'visionClearedPings'
+]
+
+# Numeric columns of the summoner's rows (the pings are detail columns), and of their lane opponent's rows (prefixed with "opp_")
+NUMERIC_COLUMNS = ['gameEndTimestamp', 'gameDuration', 'kills', 'deaths', 'assists',
+                   'totalMinionsKilled', 'neutralMinionsKilled', 'goldEarned'] + PING_COLUMNS
+OPPONENT_NUMERIC_COLUMNS = ['kills', 'deaths', 'assists', 'totalMinionsKilled', 'neutralMinionsKilled', 'goldEarned']
+
+# Text columns, stored as integer codes into an array of categories
+LABEL_COLUMNS = ['championName', 'individualPosition', 'gameMode']
+OPPONENT_LABEL_COLUMNS = ['championName', 'individualPosition']
+
+
+class MatchHistory:
+    """
+    The "Normal" games of a summoner as NumPy columns (struct of arrays), most recent first.
+      - numeric columns: int64 arrays, NULL stored as 0
+      - opponent columns: the same, prefixed with "opp_", 0 when there is no lane opponent
+      - has_opponent, win: bool arrays
+      - label columns (championName, ...): int32 codes, decoded by categories(name)
+    """
+
+    def __init__(self, columns, categories):
+        self.columns = columns
+        self._categories = categories
+
+    def __len__(self):
+        return len(self.columns['gameEndTimestamp'])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def categories(self, name):
+        return self._categories[name]
+
+    def where(self, mask):
+        """ History restricted to the rows of a boolean mask (or an index array) """
+        return MatchHistory({name: column[mask] for name, column in self.columns.items()}, self._categories)
+
+    def window(self, size):
+        """ The size most recent games, without copying the columns """
+        return MatchHistory({name: column[:size] for name, column in self.columns.items()}, self._categories)
+
+    def mean(self, name):
+        return float(self.columns[name].mean()) if len(self) else 0.0
+
+    def first_seen(self, *names):
+        """
+        Distinct combinations of label columns, in the order of their most recent game.
+        Returns a list of tuples of decoded values.
+        """
+        if not len(self):
+            return []
+        codes = np.stack([self.columns[n] for n in names], axis=1)
+        _, first = np.unique(codes, axis=0, return_index=True)
+        first.sort()
+        return [tuple(self._categories[n][codes[i, k]] for k, n in enumerate(names)) for i in first]
+
+    @classmethod
+    def load(cls, conn, puuid, batch_size=5000):
+        """
+        Load the history of a summoner in one query: its rows, joined with their lane opponent and team result.
+        The rows are streamed by batches (a server-side cursor on PostgreSQL) and turned into arrays batch by batch.
+        """
+        p = GameParticipant.__table__
+        o = aliased(GameParticipant.__table__, name='o')
+        d = GameParticipantDetail.__table__
+        t = GameTeam.__table__
+        # same lane opponent as GameContext.opponent: same position in the other team
+        opponent_team = case((p.c.teamId == 100, 200), else_=100)
+        query = (select(p.c.id, o.c.id.label('o_id'), t.c.win,
+                        *[p.c[c] if c in p.c else d.c[c] for c in NUMERIC_COLUMNS + LABEL_COLUMNS],
+                        *[o.c[c].label(f'opp_{c}') for c in OPPONENT_NUMERIC_COLUMNS + OPPONENT_LABEL_COLUMNS])
+                 .select_from(p
+                              .outerjoin(d, d.c.participant_id == p.c.id)
+                              .outerjoin(o, and_(o.c.gameId == p.c.gameId, o.c.teamId == opponent_team,
+                                                 o.c.individualPosition == p.c.individualPosition))
+                              .outerjoin(t, and_(t.c.gameId == p.c.gameId, t.c.teamId == p.c.teamId)))
+                 .where(p.c.puuid == puuid, p.c.gameStatusProcess == 'Normal')
+                 .order_by(p.c.gameEndTimestamp.desc(), p.c.id, o.c.id))
+        numeric = NUMERIC_COLUMNS + [f'opp_{c}' for c in OPPONENT_NUMERIC_COLUMNS]
+        labels = LABEL_COLUMNS + [f'opp_{c}' for c in OPPONENT_LABEL_COLUMNS]
+        result = conn.execution_options(yield_per=batch_size).execute(query)
+        names = list(result.keys())
+        chunks = {name: [] for name in ['id', 'has_opponent', 'win'] + numeric + labels}
+        for rows in result.partitions():
+            raw = dict(zip(names, zip(*rows)))
+            chunks['id'].append(np.array(raw['id'], dtype=np.int64))
+            for name in numeric:
+                # NULL becomes NaN, then 0
+                chunks[name].append(np.nan_to_num(np.array(raw[name], dtype=np.float64)).astype(np.int64))
+            for name in labels:
+                chunks[name].append(np.array([v or '' for v in raw[name]], dtype=str))
+            chunks['has_opponent'].append(np.array([v is not None for v in raw['o_id']], dtype=bool))
+            chunks['win'].append(np.array([bool(v) for v in raw['win']], dtype=bool))
+        empty = {'id': np.int64, 'has_opponent': bool, 'win': bool, **{n: np.int64 for n in numeric}, **{n: str for n in labels}}
+        raw = {name: np.concatenate(parts) if parts else np.array([], dtype=empty[name]) for name, parts in chunks.items()}
+
+        # a row joined with several opponents only keeps the first one
+        _, keep = np.unique(raw['id'], return_index=True)
+        keep.sort()
+
+        columns, categories = {}, {}
+        for name in numeric + ['has_opponent', 'win']:
+            columns[name] = raw[name][keep]
+        for name in labels:
+            categories[name], codes = np.unique(raw[name][keep], return_inverse=True)
+            columns[name] = codes.astype(np.int32).reshape(len(keep))
+        return cls(columns, categories)
+
+
+class AnalyticsStore:
+    """
+    MatchHistory of the most recently used summoners, loaded once per data version
+    (see DatabaseManager.fetch_data_version): an ingest adding games makes the next call reload it.
+    """
+
+    def __init__(self, db, max_summoners=8):
+        self.db = db
+        self.max_summoners = max_summoners
+        self._histories = OrderedDict()
+        self._lock = threading.Lock()
+
+    def history(self, puuid):
+        version = self.db.fetch_data_version(puuid)
+        with self._lock:
+            entry = self._histories.get(puuid)
+            if entry is not None and version is not None and entry[0] == version:
+                self._histories.move_to_end(puuid)
+                return entry[1]
+
+        with self.db.engine.connect() as conn:
+            history = MatchHistory.load(conn, puuid)
+        logger.info(f"Loaded {len(history)} games of {puuid} in columns")
+
+        if version is not None:
+            with self._lock:
+                self._histories[puuid] = (version, history)
+                self._histories.move_to_end(puuid)
+                while len(self._histories) > self.max_summoners:
+                    self._histories.popitem(last=False)
+        return history
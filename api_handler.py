@@ -2,7 +2,11 @@ import requests
 import logging
 import sys
 import time
-from database import DatabaseManager
+import threading
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from rate_limiter import RateLimiter
+from config import Config
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -10,14 +14,59 @@ logger = logging.getLogger(__name__)
 class APIHandler:
     """Gère la récupération des données de l'API"""
     
-    def __init__(self):
-        self.db = DatabaseManager()
+    def __init__(self, http_config=None):
+        self.http_config = http_config or Config().read_http_config()
+        self.timeout = (self.http_config['connect_timeout'], self.http_config['read_timeout'])
+        self._sessions = {}
+        self._sessions_lock = threading.Lock()
+        self._limiters = {}
+
+    """ Return the keep-alive session of the host of the url (europe.api.riotgames.com, euw1.api.riotgames.com, ...).
+     Each host gets its own connection pool, shared by every thread of the ingest. """
+    def session_for(self, url):
+        host = urlsplit(url).netloc
+        with self._sessions_lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.http_config['pool_size'])
+                session.mount("https://", adapter)
+                session.headers.update({'Accept-Encoding': 'gzip', 'Connection': 'keep-alive'})
+                self._sessions[host] = session
+            return session
+
+    """ Return the rate limiter of the host of the url. Riot counts the application and method limits
+     per routing host, so the requests to europe, americas, euw1, na1, ... never wait for each other. """
+    def limiter_for(self, url):
+        host = urlsplit(url).netloc
+        with self._sessions_lock:
+            limiter = self._limiters.get(host)
+            if limiter is None:
+                limiter = RateLimiter()
+                self._limiters[host] = limiter
+            return limiter
+
+    """ Send one GET request with the key in the X-Riot-Token header """
+    def get(self, url, params, api_key):
+        return self.session_for(url).get(url, params=params, headers={'X-Riot-Token': api_key}, timeout=self.timeout)
+
+    def close(self):
+        with self._sessions_lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions = {}
 
     """ Try one request to the RIOT API to verify if the key has expired """
     def test_api_connection(self, user_config, url_config):
         account_url = url_config["account_base_url"] + "/" + user_config['gameName'] + "/" + user_config['tagLine']
-        params = {'api_key': user_config['api_key']}
-        r = requests.get(account_url, params=params)
+        limiter = self.limiter_for(account_url)
+        limiter.acquire('account')
+        try:
+            r = self.get(account_url, None, user_config['api_key'])
+        except requests.RequestException as e:
+            logger.error(f"API connection failed: {e}")
+            return False
+        limiter.update('account', r.headers)
         if r.status_code == 200:
             logger.info("API connection successful")
             return True
@@ -32,32 +81,68 @@ class APIHandler:
             logger.error(f"API connection failed with status code {status}: {message}")
             return False
 
-    """ The RIOT API accept only 100 requests every 2 minutes.
-     Thus, we need to make a request every 1.2 seconds.
-     If a request fails, it is mostly due to "rate limit exceed". Thus, we wait and retry. """
-    def make_request(self, url, params):
-        r = requests.get(url, params)
-        time.sleep(1.2)
-        if r.status_code != 200:
-            r = r.json()
-            status = r["status"]["status_code"]
-            message = r["status"]["message"]
+    """ The RIOT API limits the number of requests per application and per method, on each routing host.
+     The limiter of the host learns these limits from the response headers and only waits when a window is exhausted.
+     If we still get a "rate limit exceeded", we wait as long as Riot asks and retry, up to max_rate_limited times:
+     past it, the key is throttled for good (e.g. shared with another client) and None is returned.
+     Server errors are retried a few times, other errors are logged and None is returned. """
+    def make_request(self, url, params, method, api_key, max_retries=5, max_rate_limited=10):
+        limiter = self.limiter_for(url)
+        retries = 0
+        rate_limited = 0
+        while True:
+            limiter.acquire(method)
+            try:
+                r = self.get(url, params, api_key)
+            except requests.RequestException as e:
+                logger.error(f"API request to {url} failed: {e}")
+                if retries < max_retries:
+                    retries += 1
+                    time.sleep(1.2 * retries)
+                    continue
+                return None
+            limiter.update(method, r.headers)
+
+            if r.status_code == 200:
+                return r.json()
+
+            try:
+                err = r.json()
+                status = err["status"]["status_code"]
+                message = err["status"]["message"]
+            except Exception:
+                status = r.status_code
+                message = r.text
             logger.error(f"API connection failed with status code {status} : {message}")
-            time.sleep(1.2)
-            self.make_request(url, params)
-        else:
-            return r.json()
+
+            if r.status_code == 429:
+                retry_after = limiter.penalize(method, r.headers)
+                if rate_limited >= max_rate_limited:
+                    logger.error(f"Rate limit exceeded {rate_limited + 1} times on {method} ({urlsplit(url).netloc}), giving up on {url}")
+                    return None
+                rate_limited += 1
+                logger.info(f"Rate limit exceeded on {method} ({urlsplit(url).netloc}), retrying in {retry_after}s")
+                continue
+
+            if r.status_code >= 500 and retries < max_retries:
+                retries += 1
+                time.sleep(1.2 * retries)
+                continue
+
+            return None
         
     """ Fetch the puuid of the summoner for further requests """
     def fetch_puuid(self, user_config, url_config):
-        account_url = url_config["account_base_url"] + "/" + user_config['gameName'] + "/" + user_config['tagLine'] + "?api_key=" + user_config['api_key']
-        params = {'api_key': user_config['api_key']}
-        r = self.make_request(account_url, params)
+        account_url = url_config["account_base_url"] + "/" + user_config['gameName'] + "/" + user_config['tagLine']
+        r = self.make_request(account_url, None, 'account', user_config['api_key'])
 
         return r["puuid"]
     
-    """ Fetch all matches id for further requests """
-    def fetch_all_matches(self, url_config, user_config, summoner):
+    """ Fetch all matches id for further requests.
+     For an incremental sync, start_time (epoch seconds) only lists the games played since then,
+     and is_known(ids) stops the paging as soon as a page contains a game already stored.
+     Return None if a page could not be fetched, since the listing is then incomplete. """
+    def fetch_all_matches(self, url_config, user_config, summoner, start_time=None, is_known=None):
         all_games = []
 
         matches_url = url_config["match_base_url"] + "/by-puuid/" + summoner["puuid"] + "/ids"
@@ -66,38 +151,45 @@ class APIHandler:
         start = 0
         while proceed:
 
-            params = {'api_key': user_config['api_key'],
-                    'start': start,
+            params = {'start': start,
                     'count': 100}
-            r = self.make_request(matches_url, params)
+            if start_time is not None:
+                params['startTime'] = start_time
+            r = self.make_request(matches_url, params, 'match_ids', user_config['api_key'])
+            if r is None:
+                # the ids of the failed page and of the older ones are unknown: a partial list would read as complete
+                logger.error(f"Listing of the games of {summoner['puuid']} failed at {start}")
+                return None
 
             proceed = (len(r) == 100)
             all_games.extend(r)
             start+=100
 
+            # ids are listed from the newest game, so everything after a known game is known too
+            if proceed and is_known is not None and is_known(r):
+                break
+
         return all_games
 
     """ Fetch a match from its id """
     def fetch_match(self, url_config, user_config, match_id):
         match_url = url_config["match_base_url"] + "/" + match_id
 
-        params = {'api_key': user_config['api_key']}
-        r = self.make_request(match_url, params)
+        r = self.make_request(match_url, None, 'match', user_config['api_key'])
 
         return r
     
-    """ Fetch summoner rank """
+    """ Fetch summoner rank. Return None if the request failed """
     def fetch_summoner_rank(self, url_config, user_config, puuid):
         
         summoner_url = url_config["league_base_url"] + "/" + puuid
-        params = {'api_key': user_config['api_key']}
-        r = self.make_request(summoner_url, params)
+        r = self.make_request(summoner_url, None, 'league', user_config['api_key'])
+        if r is None:
+            return None
         
-        if len(r) > 0:
-            for i in range(len(r)):
-                queue = r[i]
-                if queue["queueType"] == "RANKED_SOLO_5x5":
-                    return queue["tier"] + "_" + queue["rank"]
-        else:
-            # default rank
-            return "Unranked"
\ No newline at end of file
+        for queue in r:
+            if queue["queueType"] == "RANKED_SOLO_5x5":
+                return queue["tier"] + "_" + queue["rank"]
+
+        # default rank
+        return "Unranked"
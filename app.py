@@ -1,12 +1,17 @@
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, render_template, jsonify, request, Response, make_response
 from flask_cors import CORS
-from database import DatabaseManager
+import base64
+import functools
+import json
 import logging
 import sys
-import os
-import json
-from config import Config  # Import Config
-from api_handler import APIHandler  # Import APIHandler
+import numpy as np
+from resources import get_resources
+from config import account_key, PLATFORM_ROUTING, DEFAULT_PLATFORM
+from jobs import JobManager
+from progress import ProgressChannel
+from response_cache import ResponseCache
+from analytics import AnalyticsStore, PING_COLUMNS
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -14,8 +19,46 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__, static_folder='static', template_folder='templates')
 CORS(app)
 
-db = DatabaseManager()
-config = Config()  # Instance of Config
+# engine, connection pool, HTTP sessions and settings, shared by every request
+resources = get_resources()
+config = resources.config
+db = resources.db
+# bring an existing database up to the current schema before serving it
+db.create_tables()
+progress_channel = ProgressChannel()
+jobs = JobManager(channel=progress_channel)
+response_cache = ResponseCache(resources.settings['response_cache']['response_cache_size'])
+analytics = AnalyticsStore(db)
+
+def cached(view):
+    """
+    Serve a read endpoint from response_cache while the data version of its summoner (puuid param) is unchanged.
+    Responses carry an ETag, so a client sending it back in If-None-Match gets a bodiless 304.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        puuid = request.args.get('puuid', '').strip()
+        version = db.fetch_data_version(puuid)
+        if version is None:
+            return view(*args, **kwargs)
+
+        params = tuple(sorted((k, v.strip()) for k, v in request.args.items(multi=True)
+                              if k != 'puuid' and v.strip()))
+        key = (request.path, puuid, params, version)
+        entry = response_cache.get(key)
+        if entry is None:
+            response = make_response(view(*args, **kwargs))
+            # errors are never cached
+            if response.status_code != 200:
+                return response
+            entry = response_cache.put(key, response.get_data(), response.mimetype)
+
+        response = Response(entry.body, mimetype=entry.mimetype)
+        response.set_etag(entry.etag)
+        # the browser may keep the body, but must revalidate it on every load
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
+    return wrapper
 
 @app.route('/')
 def index():
@@ -38,10 +81,10 @@ def api_add_summoner():
     Add summoner from infos in config file.
     """
     try:
-        api = APIHandler()
+        api = resources.api
         db.create_tables()
         user_config = config.read_user_config()
-        url_config = config.read_url_config()
+        url_config = config.read_url_config(user_config['platform'])
 
         api.test_api_connection(user_config, url_config)
         account_puiid = api.fetch_puuid(user_config, url_config)
@@ -79,14 +122,14 @@ def api_summoner_by_name():
         if tag:
             filters['summoner_tag'] = tag
 
-        summoners = db.fetch_data('summoner', filters=filters)
+        summoners = db.fetch_data('summoner', '*', filters=filters)
         if summoners:
             return jsonify(summoners[0])
         
         # Si pas dans DB, fetch depuis Riot et add
-        api = APIHandler()
+        api = resources.api
         user_config = config.read_user_config()
-        url_config = config.read_url_config()
+        url_config = config.read_url_config(user_config['platform'])
         puuid = api.fetch_puuid(user_config, url_config, name, tag)  # Adapte si ta fonction fetch_puuid accepte name/tag
         
         if not puuid:
@@ -112,21 +155,20 @@ def api_summoner_by_name():
 @app.route('/api/update-progress')
 def api_update_progress():
     """
-    Retourne le contenu de progress.json pour le polling du frontend
+    Retourne le dernier état de la mise à jour (percent, eta, games_done, stage_timings, ...)
     """
-    progress_file = 'progress.json'
-    try:
-        if os.path.exists(progress_file):
-            with open(progress_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            return jsonify(data)
-        else:
-            return jsonify({'percent': 0})
-    except Exception as e:
-        logger.error(f"Erreur lecture progress.json : {e}")
-        return jsonify({'percent': 0})
+    return jsonify(progress_channel.latest)
+
+@app.route('/api/update-stream')
+def api_update_stream():
+    """
+    Server-Sent Events stream of the update progress, pushed as soon as the worker publishes it.
+    """
+    return Response(progress_channel.stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/api/summary')
+@cached
 def api_summary():
     """
     Returns overall summary for a summoner.
@@ -138,38 +180,24 @@ def api_summary():
         if not puuid:
             return jsonify({'error': 'puuid required'}), 400
 
-        # Filter out remakes and ARAM with gameStatusProcess field
-        parts = db.fetch_data('game_participants', filters={'puuid': puuid, 'gameStatusProcess': 'Normal'})
-        if not parts:
+        # Filter out remakes and ARAM with gameStatusProcess field: the rollups only count "Normal" games
+        champions = db.fetch_data('champion_stats', ['matches', 'kills', 'deaths', 'assists', 'wins', 'losses'],
+                                  filters={'puuid': puuid}, row='record')
+        if not champions:
             return jsonify({'error': 'no matches found'}), 404
 
-        total_games = len({p['gameId'] for p in parts})
-        total_kills = sum((p.get('kills') or 0) for p in parts)
-        total_deaths = sum((p.get('deaths') or 0) for p in parts)
-        total_assists = sum((p.get('assists') or 0) for p in parts)
-
-        wins = 0
-        losses = 0
-        seen_games = set()
-        for p in parts:
-            gid = p.get('gameId')
-            if gid in seen_games:
-                continue
-            seen_games.add(gid)
-            team_rows = db.fetch_data('game_team', filters={'gameId': gid, 'teamId': p.get('teamId')})
-            if team_rows:
-                win_val = team_rows[0].get('win')
-                win_flag = str(win_val).lower() in ('true', 't', '1', 'yes', 'y', 'win') if win_val else False
-                if win_flag:
-                    wins += 1
-                else:
-                    losses += 1
+        total_games = sum(c.matches for c in champions)
+        total_kills = sum(c.kills for c in champions)
+        total_deaths = sum(c.deaths for c in champions)
+        total_assists = sum(c.assists for c in champions)
+        wins = sum(c.wins for c in champions)
+        losses = sum(c.losses for c in champions)
 
         winrate = (wins / max(1, (wins + losses))) * 100 if (wins + losses) > 0 else 0.0
         kda = (total_kills + total_assists) / max(1, total_deaths)
         avg_kda = kda / max(1, total_games) if total_games > 0 else kda
 
-        summoner_row = db.fetch_data('summoner', filters={'puuid': puuid})
+        summoner_row = db.fetch_data('summoner', '*', filters={'puuid': puuid})
         summoner = summoner_row[0] if summoner_row else {'puuid': puuid}
 
         return jsonify({
@@ -189,6 +217,7 @@ def api_summary():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/champions')
+@cached
 def api_champions():
     """
     Aggregated performance per champion for a summoner.
@@ -200,37 +229,12 @@ def api_champions():
         if not puuid:
             return jsonify({'error': 'puuid required'}), 400
 
-        parts = db.fetch_data('game_participants', filters={'puuid': puuid, 'gameStatusProcess': 'Normal'})
-        if not parts:
-            return jsonify([])
-
-        by_champ = {}
-        for p in parts:
-            champ = p.get('championName') or 'unknown'
-            entry = by_champ.setdefault(champ, {
-                'matches': 0, 'wins': 0, 'losses': 0, 
-                'kills': 0, 'deaths': 0, 'assists': 0,
-                'cs': 0, 'duration': 0
-            })
-            entry['matches'] += 1
-            entry['kills'] += (p.get('kills') or 0)
-            entry['deaths'] += (p.get('deaths') or 0)
-            entry['assists'] += (p.get('assists') or 0)
-            entry['cs'] += (p.get('totalMinionsKilled') + p.get('neutralMinionsKilled') or 0)
-            entry['duration'] += (int(p.get('gameDuration') or 0))
-
-            gid = p.get('gameId')
-            team_rows = db.fetch_data('game_team', filters={'gameId': gid, 'teamId': p.get('teamId')})
-            if team_rows:
-                w = team_rows[0].get('win')
-                win_flag = str(w).lower() in ('true', 't', '1', 'yes', 'y', 'win') if w else False
-                if win_flag:
-                    entry['wins'] += 1
-                else:
-                    entry['losses'] += 1
+        rows = db.fetch_data('champion_stats', ['championName', 'matches', 'wins', 'losses', 'kills', 'deaths',
+                                                'assists', 'cs', 'duration'],
+                             filters={'puuid': puuid}, order_by=['-matches', '-last_game_end'])
 
         out = []
-        for champ, v in by_champ.items():
+        for v in rows:
             matches = v['matches']
             wins = v['wins']
             losses = v['losses']
@@ -242,7 +246,7 @@ def api_champions():
             avg_kda = (avg_kills + avg_assists) / max(1, avg_deaths)
             winrate = (wins / max(1, (wins + losses))) * 100 if (wins + losses) > 0 else 0.0
             out.append({
-                'champion_name': champ,
+                'champion_name': v['championName'],
                 'matches': matches,
                 'wins': wins,
                 'losses': losses,
@@ -255,7 +259,6 @@ def api_champions():
                 'avg_duration': avg_duration
             })
 
-        out.sort(key=lambda x: x['matches'], reverse=True)
         return jsonify(out)
     except Exception as e:
         logger.error(f"api_champions error: {e}")
@@ -267,7 +270,7 @@ def api_database_status():
     Retourne si la base de données contient au moins un summoner.
     """
     try:
-        summoners = db.fetch_data('summoner')
+        summoners = db.fetch_data('summoner', ['id'], limit=1)
         has_summoner = len(summoners) > 0
         return jsonify({'has_data': has_summoner})
     except Exception as e:
@@ -280,7 +283,7 @@ def api_summoner_default():
     Get first summoner from database.
     """
     try:
-        summoners = db.fetch_data('summoner')
+        summoners = db.fetch_data('summoner', '*', limit=1)
         if summoners:
             return jsonify(summoners[0])
         return jsonify({'error': 'no summoner in database'}), 404
@@ -288,41 +291,69 @@ def api_summoner_default():
         logger.error(f"api_summoner_default error: {e}")
         return jsonify({'error': str(e)}), 500
 
+def encode_cursor(row):
+    """ Opaque pagination cursor pointing right after a game row: its (gameEndTimestamp, gameId) """
+    key = json.dumps([row.get('gameEndTimestamp'), row.get('gameId')], separators=(',', ':'))
+    return base64.urlsafe_b64encode(key.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    """ (gameEndTimestamp, gameId) of a cursor made by encode_cursor, or None if it is malformed """
+    try:
+        end, game_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return int(end), str(game_id)
+    except (ValueError, TypeError):
+        return None
+
+# the history view of static/app.js asks for 500 games at once
+MAX_MATCHES_LIMIT = 500
+
 @app.route('/api/matches')
+@cached
 def api_matches():
     """
     Return list of matches for a puuid with pagination and filters.
     Query params:
       - puuid (required)
-      - limit (optional, default 10)
+      - limit (optional, default 10, at most MAX_MATCHES_LIMIT)
       - offset (optional, default 0)
       - gameMode (optional: all, normal, solo, flex, swiftplay)
       - role (optional: all, TOP, JUNGLE, MIDDLE, BOTTOM, SUPPORT)
+      - cursor (optional: next_cursor of the previous page, used instead of offset)
+      - total (optional, default true: false skips the count of matching games)
     """
     try:
         puuid = request.args.get('puuid', '').strip()
         if not puuid:
             return jsonify({'error': 'puuid required'}), 400
 
-        limit = int(request.args.get('limit') or 10)
-        offset = int(request.args.get('offset') or 0)
+        try:
+            limit = int(request.args.get('limit') or 10)
+            offset = int(request.args.get('offset') or 0)
+        except ValueError:
+            return jsonify({'error': 'limit and offset must be integers'}), 400
+        if limit < 1 or offset < 0:
+            return jsonify({'error': 'limit must be positive and offset not negative'}), 400
+        limit = min(limit, MAX_MATCHES_LIMIT)
         gameMode = request.args.get('gameMode', 'all').lower()
         role = request.args.get('role', 'all').upper()
+        with_total = request.args.get('total', 'true').lower() != 'false'
 
-        parts = db.fetch_data('game_participants', filters={'puuid': puuid, 'gameStatusProcess': 'Normal'})
+        after = None
+        if request.args.get('cursor'):
+            after = decode_cursor(request.args['cursor'])
+            if after is None:
+                return jsonify({'error': 'invalid cursor'}), 400
 
-        # Filter by game mode
+        gameModeFull = None
         if gameMode != 'all':
             gameModeFull = {
                 'normal': 'Normal Draft',
                 'solo': 'Ranked Solo',
                 'flex': 'Ranked Flex',
                 'swiftplay': 'Swift Play'
-            }.get(gameMode, '')
-            if gameModeFull:
-                parts = [p for p in parts if p.get('gameMode') == gameModeFull]
+            }.get(gameMode)
 
-        # Filter by role
+        position = None
         if role != 'ALL':
             role_map = {
                 'TOP': 'TOP',
@@ -331,20 +362,12 @@ def api_matches():
                 'BOTTOM': 'BOTTOM',
                 'UTILITY': 'UTILITY'
             }
-            role_normalized = role_map.get(role, role)
-            parts = [p for p in parts if (p.get('individualPosition') or '').upper() == role_normalized]
+            position = role_map.get(role, role)
 
-        games = {}
-        for p in parts:
-            gid = p.get('gameId')
-            if gid not in games:
-                games[gid] = p
-        
-        game_list = sorted(games.values(), 
-                          key=lambda x: int(x.get('gameEndTimestamp') or 0), 
-                          reverse=True)
-        
-        paginated = game_list[offset:offset + limit]
+        paginated, total = db.fetch_match_page(puuid, gameMode=gameModeFull, position=position,
+                                               limit=limit, offset=offset, after=after, with_total=with_total)
+        # full rows: the opponents' items and summoner spells are detail columns
+        context = db.load_game_context((p.get('gameId') for p in paginated), details=True)
         
         out = []
         for p in paginated:
@@ -354,17 +377,12 @@ def api_matches():
             assists = p.get('assists') or 0
             kda = round((kills + assists) / max(1, deaths), 2)
             position = p.get('individualPosition') or 'UNKNOWN'
-            game_timestamp = int(p.get('gameEndTimestamp') or 0)
-            game_duration = int(p.get('gameDuration') or 0)
+            game_timestamp = p.get('gameEndTimestamp') or 0
+            game_duration = p.get('gameDuration') or 0
             game_mode = p.get('gameMode') or 'Unknown'
             
             opponent_champ = 'Unknown'
-            opponent_team = 200 if p.get('teamId') == 100 else 100
-            opponents = db.fetch_data('game_participants', filters={
-                'gameId': gid,
-                'teamId': opponent_team,
-                'individualPosition': position
-            })
+            opp = context.opponent(p)
             opponent_kills = 0
             opponent_deaths = 0
             opponent_assists = 0
@@ -375,8 +393,7 @@ def api_matches():
             opponent_summoner1 = 0
             opponent_summoner2 = 0
             
-            if opponents:
-                opp = opponents[0]
+            if opp:
                 opponent_champ = opp.get('championName') or 'Unknown'
                 opponent_kills = opp.get('kills') or 0
                 opponent_deaths = opp.get('deaths') or 0
@@ -388,12 +405,7 @@ def api_matches():
                 opponent_summoner1 = opp.get('summoner1Id') or 0
                 opponent_summoner2 = opp.get('summoner2Id') or 0
             
-            team_rows = db.fetch_data('game_team', filters={'gameId': gid, 'teamId': p.get('teamId')})
-            win = False
-            if team_rows:
-                w = team_rows[0].get('win')
-                if isinstance(w, str):
-                    win = w.lower() in ('true', 't', '1', 'yes', 'y', 'win')
+            win = context.win(p)
             
             items = [p.get(f'item{i}') or 0 for i in range(6)]
             summoner1 = p.get('summoner1Id') or 0
@@ -439,17 +451,24 @@ def api_matches():
                 'gameMode': game_mode
             })
         
+        # a short page is the last one
+        next_cursor = None
+        if paginated and len(paginated) == limit:
+            next_cursor = encode_cursor(paginated[-1])
+
         return jsonify({
             'matches': out,
-            'total': len(game_list),
+            'total': total,
             'offset': offset,
-            'limit': limit
+            'limit': limit,
+            'next_cursor': next_cursor
         })
     except Exception as e:
         logger.error(f"api_matches error: {e}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/available-roles')
+@cached
 def api_available_roles():
     """
     Get list of roles played by summoner.
@@ -461,13 +480,9 @@ def api_available_roles():
         if not puuid:
             return jsonify({'error': 'puuid required'}), 400
 
-        parts = db.fetch_data('game_participants', filters={'puuid': puuid, 'gameStatusProcess': 'Normal'})
-        
-        roles = set()
-        for p in parts:
-            pos = (p.get('individualPosition') or '').upper()
-            if pos in ['TOP', 'JUNGLE', 'MIDDLE', 'BOTTOM', 'UTILITY']:
-                roles.add(pos)
+        history = analytics.history(puuid)
+        positions = history.categories('individualPosition')[np.unique(history['individualPosition'])]
+        roles = {pos.upper() for pos in positions} & {'TOP', 'JUNGLE', 'MIDDLE', 'BOTTOM', 'UTILITY'}
         
         return jsonify({'roles': sorted(list(roles))})
     except Exception as e:
@@ -481,6 +496,7 @@ def api_database_delete():
     """
     try:
         db.delete_tables()
+        response_cache.clear()
         logger.info("Database tables deleted")
         return jsonify({'success': True, 'message': 'Database cleared'})
     except Exception as e:
@@ -490,22 +506,52 @@ def api_database_delete():
 @app.route('/api/database/update', methods=['POST'])
 def api_database_update():
     """
-    Run main() from test.py to fetch and update matches.
+    Queue an update of the database (update.main), run in a background worker process.
+    Only one update of the tracked accounts can be queued or running: a second call returns the same job.
+    Query params:
+      - full (optional: true to list the whole match history)
     """
     try:
-        # Import and run main from test.py
-        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
-        from update import main
-        
-        logger.info("Starting database update...")
-        main()
-        logger.info("Database update completed")
-        return jsonify({'success': True, 'message': 'Database updated successfully'})
+        # one update covers every tracked account (config.ini and the [ACCOUNTS] of lol.ini)
+        summoner_key = ', '.join(account_key(a) for a in config.read_accounts_config())
+        full_sync = request.args.get('full', 'false').lower() == 'true'
+
+        job, created = jobs.submit(summoner_key, full_sync=full_sync)
+        message = 'Database update queued' if created else 'Database update already in progress'
+        return jsonify({'success': True, 'message': message, **job.to_dict()}), (202 if created else 200)
     except Exception as e:
         logger.error(f"api_database_update error: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/jobs')
+def api_jobs():
+    """
+    List the recent database update jobs.
+    """
+    return jsonify([job.to_dict() for job in jobs.list()])
+
+@app.route('/api/jobs/<job_id>')
+def api_job_status(job_id):
+    """
+    Status of a database update job.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'unknown job'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def api_job_cancel(job_id):
+    """
+    Cancel a queued job, or stop a running one.
+    """
+    job = jobs.cancel(job_id)
+    if job is None:
+        return jsonify({'error': 'unknown job'}), 404
+    return jsonify(job.to_dict())
+
 @app.route('/api/role-stats')
+@cached
 def api_role_stats():
     """
     Role performance stats (winrate per role).
@@ -517,44 +563,29 @@ def api_role_stats():
         if not puuid:
             return jsonify({'error': 'puuid required'}), 400
 
-        # Filter out remakes and ARAM with gameStatusProcess field
-        parts = db.fetch_data('game_participants', filters={'puuid': puuid, 'gameStatusProcess': 'Normal'})
-        if not parts:
-            return jsonify([])
-
-        by_role = {}
-        for p in parts:
-            role = p.get('individualPosition') or 'UNKNOWN'
-            entry = by_role.setdefault(role, {'matches': 0, 'wins': 0})
-            entry['matches'] += 1
-
-            gid = p.get('gameId')
-            team_rows = db.fetch_data('game_team', filters={'gameId': gid, 'teamId': p.get('teamId')})
-            if team_rows:
-                w = team_rows[0].get('win')
-                win_flag = str(w).lower() in ('true', 't', '1', 'yes', 'y', 'win') if w else False
-                if win_flag:
-                    entry['wins'] += 1
+        # Filter out remakes and ARAM with gameStatusProcess field: the rollups only count "Normal" games
+        rows = db.fetch_data('role_stats', ['individualPosition', 'matches', 'wins'],
+                             filters={'puuid': puuid}, order_by=['-matches', '-last_game_end'])
 
         out = []
-        for role, v in by_role.items():
+        for v in rows:
             matches = v['matches']
             wins = v['wins']
             winrate = (wins / max(1, matches)) * 100 if matches > 0 else 0.0
             out.append({
-                'role': role,
+                'role': v['individualPosition'],
                 'matches': matches,
                 'wins': wins,
                 'winrate': round(winrate, 2)
             })
-        
-        out.sort(key=lambda x: x['matches'], reverse=True)
+
         return jsonify(out)
     except Exception as e:
         logger.error(f"api_role_stats error: {e}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/ping-stats')
+@cached
 def api_ping_stats():
     """
     Aggregated ping statistics.
@@ -566,21 +597,11 @@ def api_ping_stats():
         if not puuid:
             return jsonify({'error': 'puuid required'}), 400
 
-        parts = db.fetch_data('game_participants', filters={'puuid': puuid, 'gameStatusProcess': 'Normal'})
-        if not parts:
+        history = analytics.history(puuid)
+        if not len(history):
             return jsonify({})
 
-        ping_types = [
-            'allInPings', 'assistMePings', 'basicPings', 'commandPings',
-            'dangerPings', 'enemyMissingPings', 'enemyVisionPings',
-            'getBackPings', 'holdPings', 'needVisionPings', 'onMyWayPings',
-            'pushPings', 'retreatPings', 'visionClearedPings'
-        ]
-
-        totals = {}
-        for ping_type in ping_types:
-            totals[ping_type] = sum((p.get(ping_type) or 0) for p in parts)
-
+        totals = {ping_type: int(history[ping_type].sum()) for ping_type in PING_COLUMNS}
         return jsonify(totals)
     except Exception as e:
         logger.error(f"api_ping_stats error: {e}")
@@ -595,6 +616,7 @@ def api_health():
         return jsonify({'status': 'unhealthy', 'error': str(e)}), 500
 
 @app.route('/api/opponent-elo-distribution')
+@cached
 def api_opponent_elo_distribution():
     """
     Get distribution of opponent ranks faced by a summoner.
@@ -607,9 +629,8 @@ def api_opponent_elo_distribution():
         if not puuid:
             return jsonify({'error': 'puuid required'}), 400
 
-        # Filter out remakes and ARAM with gameStatusProcess field
-        parts = db.fetch_data('game_participants', filters={'puuid': puuid, 'gameStatusProcess': 'Normal'})
-        opponent_ranks = []
+        # Filter out remakes and ARAM with gameStatusProcess field: the rollups only count "Normal" games
+        filters = {'puuid': puuid}
 
         # Filter by game mode
         if gameMode != 'all':
@@ -620,33 +641,19 @@ def api_opponent_elo_distribution():
                 'swiftplay': 'Swiftplay'
             }.get(gameMode, '')
             if gameModeFull:
-                parts = [p for p in parts if p.get('gameMode') == gameModeFull]
-
-        # For each game, get opponent at same position
-        for p in parts:
-            gid = p.get('gameId')
-            position = p.get('individualPosition') or 'UNKNOWN'
-            team_id = p.get('teamId')
-
-            # Get opponent team
-            opponent_team = 200 if team_id == 100 else 100
+                filters['gameMode'] = gameModeFull
 
-            # Fetch opponent at same position
-            opponents = db.fetch_data('game_participants', filters={
-                'gameId': gid,
-                'teamId': opponent_team,
-                'individualPosition': position
-            })
+        # Number of games against each lane opponent rank
+        counts = {}
+        for rank, mode, matches in db.iter_data('opponent_rank_stats', ['opponentRank', 'gameMode', 'matches'],
+                                                filters=filters):
+            if rank:
+                counts[(rank, mode)] = counts.get((rank, mode), 0) + matches
+        opponent_ranks = [{'rank': rank, 'gameMode': mode, 'count': count} for (rank, mode), count in counts.items()]
 
-            if opponents:
-                opp = opponents[0]
-                rank = opp.get('current_rank')
-                if rank:
-                    opponent_ranks.append({'rank': rank, 'gameMode': p.get('gameMode')})
-        
         return jsonify({
             'opponents': opponent_ranks,
-            'total': len(opponent_ranks)
+            'total': sum(counts.values())
         })
     except Exception as e:
         logger.error(f"api_opponent_elo_distribution error: {e}")
@@ -656,9 +663,8 @@ def api_opponent_elo_distribution():
 def api_test_api_key():
     try:
         user_config = config.read_user_config()
-        url_config = config.read_url_config()
-        api_handler = APIHandler()
-        if api_handler.test_api_connection(user_config, url_config):
+        url_config = config.read_url_config(user_config['platform'])
+        if resources.api.test_api_connection(user_config, url_config):
             return jsonify({'message': 'API key is valid'})
         else:
             return jsonify({'error': 'API key is invalid'}), 400
@@ -682,22 +688,27 @@ def api_update_api_key():
 @app.route('/api/write-user-config', methods=['POST'])
 def api_write_user_config():
     """
-    Écrit le username, usertag et api_key dans le fichier de config via la fonction existante.
+    Écrit le username, usertag, api_key et platform (euw1 par défaut) dans le fichier de config via la fonction existante.
     """
     try:
         data = request.json
         summoner_name = data.get('summoner_name')
         summoner_tag = data.get('summoner_tag')
         api_key = data.get('api_key')
+        # euw1, na1, kr, ... (optional)
+        platform = (data.get('platform') or DEFAULT_PLATFORM).lower()
 
         if not summoner_name or not summoner_tag or not api_key:
             return jsonify({'error': 'Tous les champs sont requis'}), 400
+        if platform not in PLATFORM_ROUTING:
+            return jsonify({'error': f'Unknown platform {platform}'}), 400
 
         # Utilise ta fonction existante
         config.write_user_config(
             gameName=summoner_name,
             tagLine=summoner_tag,
-            api_key=api_key
+            api_key=api_key,
+            platform=platform
         )
 
         return jsonify({'message': 'Configuration enregistrée avec succès'})
@@ -707,6 +718,7 @@ def api_write_user_config():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/last-30-summary')
+@cached
 def api_last_30_summary():
     """
     Summary of last 30 games for a summoner.
@@ -718,67 +730,30 @@ def api_last_30_summary():
         if not puuid:
             return jsonify({'error': 'puuid required'}), 400
 
-        parts = db.fetch_data('game_participants', filters={'puuid': puuid, 'gameStatusProcess': 'Normal'})
-        parts = sorted(parts, key=lambda x: int(x.get('gameEndTimestamp') or 0), reverse=True)[:30]
-
-        if not parts:
+        games = analytics.history(puuid).window(30)
+        if not len(games):
             return jsonify({'error': 'no matches found'}), 404
 
-        avg_kills = sum(int(p.get('kills') or 0) for p in parts) / len(parts)
-        avg_deaths = sum(int(p.get('deaths') or 0) for p in parts) / len(parts)
-        avg_assists = sum(int(p.get('assists') or 0) for p in parts) / len(parts)
-        avg_cs = sum(int(p.get('totalMinionsKilled') or 0) + int(p.get('neutralMinionsKilled') or 0) for p in parts) / len(parts)
-        avg_cs_min = avg_cs / (sum(int(p.get('gameDuration') or 0) for p in parts) / len(parts) / 60)
-        avg_gold = sum(int(p.get('goldEarned') or 0) for p in parts) / len(parts)
-        avg_gold_min = avg_gold / (sum(int(p.get('gameDuration') or 0) for p in parts) / len(parts) / 60)
-        avg_game_duration = sum(int(p.get('gameDuration') or 0) for p in parts) / len(parts)
-
-        champions_played = {}
-        opponents_faced = {}
-        opp_avg_kills = 0
-        opp_avg_deaths = 0
-        opp_avg_assists = 0
-        opp_avg_cs = 0
-        opp_avg_cs_min = 0
-        opp_avg_gold = 0
-        opp_avg_gold_min = 0
-        total_duration = sum(int(p.get('gameDuration') or 0) for p in parts) / len(parts)
-
-        for p in parts:
-            champ = p.get('championName')
-            role = p.get('individualPosition').upper()
-            champions_played[(champ, role)] = champions_played.get((champ, role), 0) + 1
-
-            gid = p.get('gameId')
-            position = p.get('individualPosition') or 'UNKNOWN'
-            team_id = p.get('teamId')
-            opponent_team = 200 if team_id == 100 else 100
-
-            opponents = db.fetch_data('game_participants', filters={
-                'gameId': gid,
-                'teamId': opponent_team,
-                'individualPosition': position
-            })
-
-            if opponents:
-                opp = opponents[0]
-                opp_champ = opp.get('championName')
-                opp_role = opp.get('individualPosition').upper()
-                opponents_faced[(opp_champ, opp_role)] = opponents_faced.get((opp_champ, opp_role), 0) + 1
-
-                opp_avg_kills += int(opp.get('kills') or 0)
-                opp_avg_deaths += int(opp.get('deaths') or 0)
-                opp_avg_assists += int(opp.get('assists') or 0)
-                opp_avg_cs += int(opp.get('totalMinionsKilled') or 0) + int(opp.get('neutralMinionsKilled') or 0)
-                opp_avg_gold += int(opp.get('goldEarned') or 0)
-
-        opp_avg_kills /= len(parts)
-        opp_avg_deaths /= len(parts)
-        opp_avg_assists /= len(parts)
-        opp_avg_cs /= len(parts)
-        opp_avg_cs_min = opp_avg_cs / (total_duration / 60)
-        opp_avg_gold /= len(parts)
-        opp_avg_gold_min = opp_avg_gold / (total_duration / 60)
+        avg_kills = games.mean('kills')
+        avg_deaths = games.mean('deaths')
+        avg_assists = games.mean('assists')
+        avg_cs = games.mean('totalMinionsKilled') + games.mean('neutralMinionsKilled')
+        avg_game_duration = games.mean('gameDuration')
+        avg_cs_min = avg_cs / (avg_game_duration / 60)
+        avg_gold = games.mean('goldEarned')
+        avg_gold_min = avg_gold / (avg_game_duration / 60)
+
+        champions_played = games.first_seen('championName', 'individualPosition')
+        opponents_faced = games.where(games['has_opponent']).first_seen('opp_championName', 'opp_individualPosition')
+
+        # opponent columns are 0 without a lane opponent, the averages are over every game
+        opp_avg_kills = games.mean('opp_kills')
+        opp_avg_deaths = games.mean('opp_deaths')
+        opp_avg_assists = games.mean('opp_assists')
+        opp_avg_cs = games.mean('opp_totalMinionsKilled') + games.mean('opp_neutralMinionsKilled')
+        opp_avg_cs_min = opp_avg_cs / (avg_game_duration / 60)
+        opp_avg_gold = games.mean('opp_goldEarned')
+        opp_avg_gold_min = opp_avg_gold / (avg_game_duration / 60)
 
         return jsonify({
             'avg_kills': round(avg_kills, 1),
@@ -789,8 +764,8 @@ def api_last_30_summary():
             'avg_gold': round(avg_gold, 1),
             'avg_gold_min': round(avg_gold_min, 1),
             'avg_game_duration': round(avg_game_duration, 1),
-            'champions_played': list(champions_played.keys()),
-            'opponents_faced': list(opponents_faced.keys()),
+            'champions_played': [(champ, role.upper()) for champ, role in champions_played],
+            'opponents_faced': [(champ, role.upper()) for champ, role in opponents_faced],
             'opp_avg_kills': round(opp_avg_kills, 1),
             'opp_avg_deaths': round(opp_avg_deaths, 1),
             'opp_avg_assists': round(opp_avg_assists, 1),
@@ -804,6 +779,7 @@ def api_last_30_summary():
         return jsonify({'error': str(e)}), 500
     
 @app.route('/api/matchup-stats')
+@cached
 def api_matchup_stats():
     """
     Statistics per matchup for a summoner.
@@ -817,95 +793,30 @@ def api_matchup_stats():
         if not puuid:
             return jsonify({'error': 'puuid required'}), 400
 
-        parts = db.fetch_data('game_participants', filters={'puuid': puuid, 'gameStatusProcess': 'Normal'})
-
-        parts = sorted(parts, 
-                          key=lambda x: int(x['gameEndTimestamp'] or 0), 
-                          reverse=True)
-
+        filters = {'puuid': puuid}
         if role != 'ALL':
-            parts = [p for p in parts if (p.get('individualPosition') or '').upper() == role]
-
-        by_matchup = {}
-
-        for p in parts:
-            my_champ = p.get('championName') or 'Unknown'
-            my_role = p.get('individualPosition').upper()
-            gid = p.get('gameId')
-            position = p.get('individualPosition') or 'UNKNOWN'
-            team_id = p.get('teamId')
-
-            opponent_team = 200 if team_id == 100 else 100
-
-            opponents = db.fetch_data('game_participants', filters={
-                'gameId': gid,
-                'teamId': opponent_team,
-                'individualPosition': position
-            })
-
-            if opponents:
-                opp = opponents[0]
-                opp_champ = opp.get('championName') or 'Unknown'
-                opp_role = opp.get('individualPosition').upper()
-
-                key = (my_champ, my_role, opp_champ, opp_role)
-
-                entry = by_matchup.setdefault(key, {
-                    'matches': 0,
-                    'wins': 0,
-                    'my_kills': 0,
-                    'my_deaths': 0,
-                    'my_assists': 0,
-                    'my_cs': 0,
-                    'my_gold': 0,
-                    'opp_kills': 0,
-                    'opp_deaths': 0,
-                    'opp_assists': 0,
-                    'opp_cs': 0,
-                    'opp_gold': 0,
-                    'duration': 0,
-                    'recent_form': []
-                })
-
-                entry['matches'] += 1
-                entry['my_kills'] += int(p.get('kills') or 0)
-                entry['my_deaths'] += int(p.get('deaths') or 0)
-                entry['my_assists'] += int(p.get('assists') or 0)
-                entry['my_cs'] += int(p.get('totalMinionsKilled') or 0) + int(p.get('neutralMinionsKilled') or 0)
-                entry['my_gold'] += int(p.get('goldEarned') or 0)
-
-                entry['opp_kills'] += int(opp.get('kills') or 0)
-                entry['opp_deaths'] += int(opp.get('deaths') or 0)
-                entry['opp_assists'] += int(opp.get('assists') or 0)
-                entry['opp_cs'] += int(opp.get('totalMinionsKilled') or 0) + int(opp.get('neutralMinionsKilled') or 0)
-                entry['opp_gold'] += int(opp.get('goldEarned') or 0)
-
-                entry['duration'] += int(p.get('gameDuration') or 0)
-
-                team_rows = db.fetch_data('game_team', filters={'gameId': gid, 'teamId': team_id})
-                win = False
-                if team_rows:
-                    w = team_rows[0].get('win')
-                    win = str(w).lower() in ('true', 't', '1', 'yes', 'y', 'win')
-
-                if win:
-                    entry['wins'] += 1
-                    entry['recent_form'].append('W')
-                else:
-                    entry['recent_form'].append('L')
+            filters['individualPosition'] = role
+        rows = db.fetch_data('matchup_stats', ['championName', 'individualPosition', 'opponentChampionName', 'matches',
+                                               'wins', 'kills', 'deaths', 'assists', 'cs', 'gold', 'opp_kills',
+                                               'opp_deaths', 'opp_assists', 'opp_cs', 'opp_gold', 'duration',
+                                               'recent_form'],
+                             filters=filters, order_by=['-matches', '-last_game_end'])
 
         out = []
-        for (my_champ, my_role, opp_champ, opp_role), v in by_matchup.items():
+        for v in rows:
+            # the lane opponent plays the same position
+            my_champ, my_role, opp_champ, opp_role = (v['championName'], v['individualPosition'],
+                                                      v['opponentChampionName'], v['individualPosition'])
             matches = v['matches']
             wins = v['wins']
             avg_duration = v['duration'] / matches
 
-            my_avg_kills = v['my_kills'] / matches
-            my_avg_deaths = v['my_deaths'] / matches
-            my_avg_assists = v['my_assists'] / matches
-            my_avg_cs = v['my_cs'] / matches
+            my_avg_kills = v['kills'] / matches
+            my_avg_deaths = v['deaths'] / matches
+            my_avg_assists = v['assists'] / matches
+            my_avg_cs = v['cs'] / matches
             my_cs_min = my_avg_cs / (avg_duration / 60) if avg_duration > 0 else 0
-            my_avg_gold = v['my_gold'] / matches
+            my_avg_gold = v['gold'] / matches
             my_gold_min = my_avg_gold / (avg_duration / 60) if avg_duration > 0 else 0
 
             opp_avg_kills = v['opp_kills'] / matches
@@ -939,16 +850,16 @@ def api_matchup_stats():
                 'opp_cs_min': round(opp_cs_min, 1),
                 'opp_avg_gold': round(opp_avg_gold, 1),
                 'opp_gold_min': round(opp_gold_min, 1),
-                'recent_form': v['recent_form'][:5]
+                'recent_form': [result for _, result in json.loads(v['recent_form'])]
             })
 
-        out.sort(key=lambda x: x['matches'], reverse=True)
         return jsonify(out)
     except Exception as e:
         logger.error(f"api_matchup_stats error: {e}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/performance')
+@cached
 def api_performance():
     """
     Get performance stats against opponent ranks.
@@ -962,7 +873,7 @@ def api_performance():
         if not puuid:
             return jsonify({'error': 'puuid required'}), 400
 
-        parts = db.fetch_data('game_participants', filters={'puuid': puuid, 'gameStatusProcess': 'Normal'})
+        filters = {'puuid': puuid}
 
         # Filter by game mode
         if gameMode != 'all':
@@ -973,87 +884,48 @@ def api_performance():
                 'swiftplay': 'Swift Play'
             }.get(gameMode, '')
             if gameModeFull:
-                parts = [p for p in parts if p.get('gameMode') == gameModeFull]
+                filters['gameMode'] = gameModeFull
 
         by_opp_rank = {}
         ranks = ['IRON', 'BRONZE', 'SILVER', 'GOLD', 'PLATINUM', 'EMERALD', 'DIAMOND', 'MASTER']
         roles = ['TOP', 'JUNGLE', 'MIDDLE', 'BOTTOM', 'SUPPORT']
+        counters = ['kills', 'deaths', 'assists', 'cs', 'gold', 'duration']
+
+        # one row per (game mode, position, lane opponent rank)
+        rows = db.iter_data('opponent_rank_stats', ['opponentRank', 'individualPosition', 'matches', 'wins', 'losses']
+                            + counters, filters=filters, row='dict')
+        for row in rows:
+            opp_rank = (row['opponentRank'] or 'UNRANKED').split('_')[0].upper()
+            if opp_rank not in ranks:
+                continue  # Skip if not in defined ranks
+
+            role = row['individualPosition']
+            if role == 'UTILITY':
+                role = 'SUPPORT'
+            if role not in roles:
+                continue
 
-        for p in parts:
-            gid = p.get('gameId')
-            position = p.get('individualPosition') or 'UNKNOWN'
-            team_id = p.get('teamId')
-
-            opponent_team = 200 if team_id == 100 else 100
-
-            opponents = db.fetch_data('game_participants', filters={
-                'gameId': gid,
-                'teamId': opponent_team,
-                'individualPosition': position
-            })
-
-            if opponents:
-                opp = opponents[0]
-                opp_rank_str = opp.get('current_rank') or 'UNRANKED'
-                parts_rank = opp_rank_str.split('_')
-                opp_rank = parts_rank[0].upper() if parts_rank else 'UNRANKED'
-                if opp_rank not in ranks:
-                    continue  # Skip if not in defined ranks
-                if opp_rank in ['GRANDMASTER', 'CHALLENGER']:
-                    opp_rank = 'MASTER'
-
-                role = position.upper()
-                if role == 'UTILITY':
-                    role = 'SUPPORT'
-                if role not in roles:
-                    continue
+            if opp_rank not in by_opp_rank:
+                by_opp_rank[opp_rank] = {
+                    'total_matches': 0,
+                    'wins': 0,
+                    'losses': 0,
+                    'kills': 0,
+                    'deaths': 0,
+                    'assists': 0,
+                    'cs': 0,
+                    'gold': 0,
+                    'duration': 0,
+                    'by_role': {r: {'matches': 0, 'wins': 0, 'losses': 0, 'kills': 0, 'deaths': 0, 'assists': 0, 'cs': 0, 'gold': 0, 'duration': 0} for r in roles}
+                }
 
-                if opp_rank not in by_opp_rank:
-                    by_opp_rank[opp_rank] = {
-                        'total_matches': 0,
-                        'wins': 0,
-                        'losses': 0,
-                        'kills': 0,
-                        'deaths': 0,
-                        'assists': 0,
-                        'cs': 0,
-                        'gold': 0,
-                        'duration': 0,
-                        'by_role': {r: {'matches': 0, 'wins': 0, 'losses': 0, 'kills': 0, 'deaths': 0, 'assists': 0, 'cs': 0, 'gold': 0, 'duration': 0} for r in roles}
-                    }
-
-                rank_data = by_opp_rank[opp_rank]
-                rank_data['total_matches'] += 1
-                rank_data['kills'] += p.get('kills', 0)
-                rank_data['deaths'] += p.get('deaths', 0)
-                rank_data['assists'] += p.get('assists', 0)
-                rank_data['cs'] += p.get('totalMinionsKilled', 0) + p.get('neutralMinionsKilled', 0)
-                rank_data['gold'] += p.get('goldEarned', 0)
-                rank_data['duration'] += (int(p.get('gameDuration') or 0))
-
-                team_rows = db.fetch_data('game_team', filters={'gameId': gid, 'teamId': team_id})
-                win = False
-                if team_rows:
-                    win_val = team_rows[0].get('win')
-                    win = str(win_val).lower() in ('true', 't', '1', 'yes', 'y', 'win')
-
-                if win:
-                    rank_data['wins'] += 1
-                else:
-                    rank_data['losses'] += 1
-
-                role_data = rank_data['by_role'][role]
-                role_data['matches'] += 1
-                role_data['kills'] += p.get('kills', 0)
-                role_data['deaths'] += p.get('deaths', 0)
-                role_data['assists'] += p.get('assists', 0)
-                role_data['cs'] += p.get('totalMinionsKilled', 0) + p.get('neutralMinionsKilled', 0)
-                role_data['gold'] += p.get('goldEarned', 0)
-                role_data['duration'] += (int(p.get('gameDuration') or 0))
-                if win:
-                    role_data['wins'] += 1
-                else:
-                    role_data['losses'] += 1
+            rank_data = by_opp_rank[opp_rank]
+            role_data = rank_data['by_role'][role]
+            rank_data['total_matches'] += row['matches']
+            role_data['matches'] += row['matches']
+            for key in ['wins', 'losses'] + counters:
+                rank_data[key] += row[key]
+                role_data[key] += row[key]
 
         out = {'by_rank': {}}
         for rank in ranks:
@@ -1125,6 +997,7 @@ def match_details():
     return render_template('match_details.html')
 
 @app.route('/api/match-details')
+@cached
 def api_match_details():
     try:
         gameId = request.args.get('gameId')
@@ -1132,10 +1005,10 @@ def api_match_details():
             return jsonify({'error': 'gameId required'}), 400
 
         # Fetch teams stats
-        teams = db.fetch_data('game_team', filters={'gameId': gameId})
+        teams = db.fetch_data('game_team', '*', filters={'gameId': gameId}, order_by=['id'])
         
-        # Fetch participants
-        participants = db.fetch_data('game_participants', filters={'gameId': gameId})
+        # Fetch participants, in the order of the game (insertion order)
+        participants = db.fetch_data('game_participants', '*', filters={'gameId': gameId}, order_by=['id'])
         
         # Map roles
         for p in participants:
@@ -0,0 +1,181 @@
+"""
+Latency of /api/matches while an ingest writes into the same SQLite database.
+
+For each storage profile, a throwaway database is seeded with synthetic games, then a writer
+process inserts batches of games like update.main does while the dashboard app serves
+/api/matches in this process. The response cache is cleared before each request, so every
+read goes to the database.
+
+    python benchmarks/matches_read_latency.py [--duration 15] [--seed-games 2000] [--profiles tuned,rollback]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+# the profiles are SQLite ones: never benchmark the database of the environment
+os.environ.pop('DATABASE_URL', None)
+
+PUUID = 'BENCH_PUUID'
+POSITIONS = ['TOP', 'JUNGLE', 'MIDDLE', 'BOTTOM', 'UTILITY']
+CHAMPIONS = ['Ahri', 'Garen', 'LeeSin', 'Jinx', 'Thresh', 'Darius', 'Lux', 'Vayne', 'Orianna', 'Nautilus']
+GAME_MODES = ['Ranked Solo', 'Ranked Flex', 'Normal Draft']
+
+# [SQLITE] settings of each profile, written into the config of the throwaway database
+PROFILES = {
+    # config/lol.ini
+    'tuned': {},
+    # SQLite defaults: rollback journal, a 2 MiB page cache, no memory mapping
+    'rollback': {'journal_mode': 'DELETE', 'synchronous': 'FULL', 'cache_size_mb': 2,
+                 'mmap_size_mb': 0, 'temp_store': 'DEFAULT'},
+}
+
+
+def make_game(n, rng):
+    """ A cured game, as built by update.cure_game, where the benchmarked summoner plays """
+    game_id = f'BENCH_{n}'
+    end = 1_600_000_000_000 + n * 1_800_000
+    mode = rng.choice(GAME_MODES)
+    participants = []
+    for i in range(10):
+        participants.append({
+            'puuid': PUUID if i == 0 else f'P_{rng.randrange(50_000)}',
+            'gameId': game_id, 'gameEndTimestamp': end, 'gameDuration': rng.randrange(900, 2400),
+            'gameVersion': '14.1', 'gameMode': mode, 'gameStatusProcess': 'Normal', 'current_rank': 'GOLD_II',
+            'teamId': 100 if i < 5 else 200, 'individualPosition': POSITIONS[i % 5],
+            'championName': rng.choice(CHAMPIONS),
+            'kills': rng.randrange(15), 'deaths': rng.randrange(15), 'assists': rng.randrange(20),
+            'totalMinionsKilled': rng.randrange(300), 'neutralMinionsKilled': rng.randrange(50),
+            'goldEarned': rng.randrange(5000, 20000),
+        })
+    win = rng.random() < 0.5
+    teams = [{'gameId': game_id, 'gameMode': mode, 'teamId': team, 'win': win == (team == 100), 'remake': False}
+             for team in (100, 200)]
+    return {'game_id': game_id, 'participants': participants, 'teams': teams}
+
+
+def write_profile(workdir, settings):
+    """ Copy config/lol.ini into workdir with the [SQLITE] settings of a profile """
+    with open(os.path.join(REPO, 'config', 'lol.ini')) as f:
+        ini = f.read()
+    for key, value in settings.items():
+        ini = re.sub(rf'^{key} = .*$', f'{key} = {value}', ini, count=1, flags=re.MULTILINE)
+    os.makedirs(os.path.join(workdir, 'config'))
+    with open(os.path.join(workdir, 'config', 'lol.ini'), 'w') as f:
+        f.write(ini)
+
+
+def seed(seed_games, batch_size):
+    from resources import get_resources
+    db = get_resources().db
+    db.create_tables()
+    db.insert_summoner({'summoner_name': 'bench', 'summoner_tag': 'EUW', 'puuid': PUUID, 'current_rank': 'GOLD_II'})
+    rng = random.Random(0)
+    for start in range(0, seed_games, batch_size):
+        db.insert_games([make_game(n, rng) for n in range(start, min(start + batch_size, seed_games))])
+    db.checkpoint('TRUNCATE')
+
+
+def writer(workdir, first_game, batch_size, ready, stop, results):
+    """ Insert batches of new games until stopped, like the writer stage of update.main """
+    os.chdir(workdir)
+    sys.path.insert(0, REPO)
+    import logging
+    logging.disable(logging.INFO)
+    from resources import get_resources
+    resources = get_resources()
+    checkpoint_every = resources.settings['ingest']['checkpoint_every_batches']
+    db = resources.db
+    rng = random.Random(1)
+    n, batches, failed, durations = first_game, 0, 0, []
+    ready.set()
+    while not stop.is_set():
+        games = [make_game(n + i, rng) for i in range(batch_size)]
+        start = time.perf_counter()
+        if db.insert_games(games):
+            batches += 1
+            if checkpoint_every and batches % checkpoint_every == 0:
+                db.checkpoint('PASSIVE')
+        else:
+            failed += 1
+        durations.append(time.perf_counter() - start)
+        n += batch_size
+    results.put({'batches': batches, 'failed': failed, 'durations': durations})
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else float('nan')
+
+
+def run(name, duration, seed_games, batch_size):
+    workdir = tempfile.mkdtemp(prefix=f'bench_{name}_')
+    cwd = os.getcwd()
+    try:
+        write_profile(workdir, PROFILES[name])
+        os.chdir(workdir)
+        seed(seed_games, batch_size)
+
+        # a fresh import, so that the app serves the database seeded above
+        sys.modules.pop('app', None)
+        import app as dashboard
+        client = dashboard.app.test_client()
+
+        ctx = multiprocessing.get_context('spawn')
+        ready, stop, results = ctx.Event(), ctx.Event(), ctx.Queue()
+        process = ctx.Process(target=writer, args=(workdir, seed_games, batch_size, ready, stop, results))
+        process.start()
+        ready.wait()
+
+        rng = random.Random(2)
+        latencies, errors = [], 0
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            dashboard.response_cache.clear()
+            offset = rng.randrange(0, 200, 10)
+            start = time.perf_counter()
+            response = client.get(f'/api/matches?puuid={PUUID}&limit=10&offset={offset}')
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200 or not response.get_json().get('matches'):
+                errors += 1
+
+        stop.set()
+        writes = results.get()
+        process.join()
+        wal = os.path.join(workdir, '.lol_dashboard', 'lol_data.db-wal')
+        wal_size = os.path.getsize(wal) if os.path.exists(wal) else 0
+    finally:
+        # the next profile opens its own database
+        from resources import close_resources
+        close_resources()
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    ms = lambda seconds: f'{seconds * 1000:8.1f}'
+    print(f'{name:>9} | {len(latencies):6d} | {ms(percentile(latencies, 0.5))} | {ms(percentile(latencies, 0.95))} | '
+          f'{ms(percentile(latencies, 0.99))} | {ms(max(latencies))} | {errors:6d} | '
+          f'{writes["batches"]:7d} | {ms(percentile(writes["durations"], 0.5))} | {writes["failed"]:6d} | '
+          f'{wal_size / 1024 / 1024:6.1f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Latency of /api/matches while an ingest writes")
+    parser.add_argument('--duration', type=float, default=15, help="seconds of reads per profile")
+    parser.add_argument('--seed-games', type=int, default=2000, help="games in the database before the ingest starts")
+    parser.add_argument('--batch-size', type=int, default=20, help="games per write transaction")
+    parser.add_argument('--profiles', default=','.join(PROFILES), help="comma separated profiles to run")
+    args = parser.parse_args()
+
+    import logging
+    logging.disable(logging.INFO)
+    print(f'{args.seed_games} seeded games, write batches of {args.batch_size} games, {args.duration} s per profile')
+    print('  profile |  reads | p50 (ms) | p95 (ms) | p99 (ms) | max (ms) | errors | batches | write p50 | failed | WAL MiB')
+    for profile in args.profiles.split(','):
+        run(profile.strip(), args.duration, args.seed_games, args.batch_size)
@@ -1,15 +1,29 @@
+import os
 from configparser import ConfigParser
 
+# Regional routing value of each platform: the account and match APIs are served by the regional host
+# (europe.api.riotgames.com), the league API by the platform host (euw1.api.riotgames.com)
+PLATFORM_ROUTING = {
+    'br1': 'americas', 'la1': 'americas', 'la2': 'americas', 'na1': 'americas',
+    'jp1': 'asia', 'kr': 'asia',
+    'eun1': 'europe', 'euw1': 'europe', 'me1': 'europe', 'ru': 'europe', 'tr1': 'europe',
+    'oc1': 'sea', 'ph2': 'sea', 'sg2': 'sea', 'th2': 'sea', 'tw2': 'sea', 'vn2': 'sea'
+}
+# account-v1 is not served by the sea host, any other regional host knows every account
+ACCOUNT_ROUTING = {'sea': 'asia'}
+DEFAULT_PLATFORM = 'euw1'
+
 class Config:
 
     def __init__(self):
         self.config = ConfigParser()
 
-    def write_user_config(self, gameName, tagLine, api_key):
+    def write_user_config(self, gameName, tagLine, api_key, platform=DEFAULT_PLATFORM):
         self.config['USERINFO'] = {
             'gameName': gameName,
             'tagLine': tagLine,
-            'api_key': api_key
+            'api_key': api_key,
+            'platform': platform.lower()
         }
         with open('config/config.ini', 'w') as configfile:
             self.config.write(configfile)
@@ -19,15 +33,47 @@ class Config:
         return {
             'gameName': self.config.get('USERINFO', 'gameName'),
             'tagLine': self.config.get('USERINFO', 'tagLine'),
-            'api_key': self.config.get('USERINFO', 'api_key')
+            'api_key': self.config.get('USERINFO', 'api_key'),
+            'platform': self.config.get('USERINFO', 'platform', fallback=DEFAULT_PLATFORM).lower()
         }
+
+    def read_accounts_config(self):
+        """ Accounts to ingest: the one of config.ini, then the [ACCOUNTS] ones of lol.ini, all with the key of config.ini """
+        user_config = self.read_user_config()
+        accounts = [user_config]
+        self.config.read('config/lol.ini')
+        for entry in self.config.get('ACCOUNTS', 'tracked', fallback='').replace("\n", "").split(','):
+            entry = entry.strip()
+            if not entry:
+                continue
+            riot_id, _, platform = entry.partition('@')
+            gameName, _, tagLine = riot_id.partition('#')
+            if not gameName or not tagLine:
+                raise ValueError(f"Invalid account '{entry}' in [ACCOUNTS], expected gameName#tagLine@platform")
+            account = {
+                'gameName': gameName.strip(),
+                'tagLine': tagLine.strip(),
+                'api_key': user_config['api_key'],
+                'platform': (platform.strip() or DEFAULT_PLATFORM).lower()
+            }
+            # Riot ids are case insensitive
+            if all(account_key(a).lower() != account_key(account).lower() for a in accounts):
+                accounts.append(account)
+        return accounts
     
-    def read_url_config(self):
+    def read_url_config(self, platform=DEFAULT_PLATFORM):
+        """ Urls of the RIOT API for a platform (euw1, na1, kr, ...), with the {region} and {platform} hosts filled in """
+        platform = platform.lower()
+        if platform not in PLATFORM_ROUTING:
+            raise ValueError(f"Unknown platform '{platform}', expected one of {', '.join(PLATFORM_ROUTING)}")
+        region = PLATFORM_ROUTING[platform]
+        hosts = {'region': region, 'platform': platform}
         self.config.read('config/lol.ini')
         return {
-            'account_base_url': self.config.get('RIOT_API_URLS', 'account_base_url'),
-            'match_base_url': self.config.get('RIOT_API_URLS', 'match_base_url'),
-            'league_base_url': self.config.get('RIOT_API_URLS', 'league_base_url')
+            'account_base_url': self.config.get('RIOT_API_URLS', 'account_base_url').format(
+                region=ACCOUNT_ROUTING.get(region, region), platform=platform),
+            'match_base_url': self.config.get('RIOT_API_URLS', 'match_base_url').format(**hosts),
+            'league_base_url': self.config.get('RIOT_API_URLS', 'league_base_url').format(**hosts)
         }
     
     def read_useful_config(self):
@@ -38,7 +84,58 @@ class Config:
             'objectives_data': self.config.get('USEFUL_DATA', 'objectives_data').replace("\n","").split(',')
         }
     
-    def update_user_config(self, gameName=None, tagLine=None, api_key=None):
+    def read_ingest_config(self):
+        self.config.read('config/lol.ini')
+        return {
+            'fetch_workers': self.config.getint('INGEST', 'fetch_workers', fallback=4),
+            'cure_workers': self.config.getint('INGEST', 'cure_workers', fallback=4),
+            'queue_size': self.config.getint('INGEST', 'queue_size', fallback=32),
+            'write_batch_size': self.config.getint('INGEST', 'write_batch_size', fallback=20),
+            'checkpoint_every_batches': self.config.getint('INGEST', 'checkpoint_every_batches', fallback=50)
+        }
+    
+    def read_http_config(self):
+        self.config.read('config/lol.ini')
+        return {
+            'connect_timeout': self.config.getfloat('HTTP', 'connect_timeout', fallback=3.05),
+            'read_timeout': self.config.getfloat('HTTP', 'read_timeout', fallback=10),
+            'pool_size': self.config.getint('HTTP', 'pool_size', fallback=16)
+        }
+    
+    def read_rank_cache_config(self):
+        self.config.read('config/lol.ini')
+        return {
+            'rank_cache_size': self.config.getint('RANK_CACHE', 'lru_size', fallback=5000),
+            'rank_ttl_hours': self.config.getfloat('RANK_CACHE', 'ttl_hours', fallback=24)
+        }
+    
+    def read_database_config(self):
+        self.config.read('config/lol.ini')
+        return {
+            # the DATABASE_URL environment variable (set by docker-compose) wins over the config file
+            'database_url': os.environ.get('DATABASE_URL') or self.config.get('DATABASE', 'url', fallback=''),
+            'query_log_sample': self.config.getfloat('DATABASE', 'query_log_sample', fallback=0.0),
+            'pool_size': self.config.getint('DATABASE', 'pool_size', fallback=8),
+            'max_overflow': self.config.getint('DATABASE', 'max_overflow', fallback=4),
+            'pool_timeout': self.config.getint('DATABASE', 'pool_timeout', fallback=30),
+            'sqlite_pragmas': {
+                'journal_mode': self.config.get('SQLITE', 'journal_mode', fallback='WAL'),
+                'synchronous': self.config.get('SQLITE', 'synchronous', fallback='NORMAL'),
+                'cache_size_mb': self.config.getint('SQLITE', 'cache_size_mb', fallback=64),
+                'mmap_size_mb': self.config.getint('SQLITE', 'mmap_size_mb', fallback=256),
+                'busy_timeout_ms': self.config.getint('SQLITE', 'busy_timeout_ms', fallback=5000),
+                'temp_store': self.config.get('SQLITE', 'temp_store', fallback='MEMORY'),
+                'wal_autocheckpoint': self.config.getint('SQLITE', 'wal_autocheckpoint', fallback=1000)
+            }
+        }
+    
+    def read_response_cache_config(self):
+        self.config.read('config/lol.ini')
+        return {
+            'response_cache_size': self.config.getint('RESPONSE_CACHE', 'lru_size', fallback=256)
+        }
+    
+    def update_user_config(self, gameName=None, tagLine=None, api_key=None, platform=None):
         self.config.read('config/config.ini')
         if gameName:
             self.config.set('USERINFO', 'gameName', gameName)
@@ -46,5 +143,12 @@ class Config:
             self.config.set('USERINFO', 'tagLine', tagLine)
         if api_key:
             self.config.set('USERINFO', 'api_key', api_key)
+        if platform:
+            self.config.set('USERINFO', 'platform', platform.lower())
         with open('config/config.ini', 'w') as configfile:
-            self.config.write(configfile)
\ No newline at end of file
+            self.config.write(configfile)
+
+
+def account_key(account):
+    """ "gameName#tagLine" of an account of read_accounts_config """
+    return f"{account['gameName']}#{account['tagLine']}"
@@ -1,31 +1,429 @@
 import os
+import io
+import json
+import uuid
+import random
 import logging
-from datetime import datetime
-from sqlalchemy import (create_engine, Column, Integer, String, DateTime, inspect)
+import threading
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+from datetime import datetime, timedelta
+from sqlalchemy import (create_engine, Column, ForeignKey, Integer, BigInteger, Boolean, String, DateTime, inspect, func,
+                        Table, MetaData, Index, select, exists, and_, tuple_, text, event)
+from sqlalchemy.dialects import sqlite, postgresql
 from sqlalchemy.orm import sessionmaker, declarative_base
 from sqlalchemy.exc import SQLAlchemyError
+from migrations import run_migrations
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# --- Rank cache ---
+class RankCache:
+    """ Thread safe in-process LRU of puuid -> (rank, fetched_at), in front of the player_rank table """
+
+    def __init__(self, max_size=5000, ttl=timedelta(hours=24)):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, puuid):
+        with self._lock:
+            entry = self._entries.get(puuid)
+            if entry is None:
+                return None
+            rank, fetched_at = entry
+            if datetime.utcnow() - fetched_at > self.ttl:
+                del self._entries[puuid]
+                return None
+            self._entries.move_to_end(puuid)
+            return rank
+
+    def put(self, puuid, rank, fetched_at):
+        with self._lock:
+            self._entries[puuid] = (rank, fetched_at)
+            self._entries.move_to_end(puuid)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+def split_rank(rank):
+    """ "GOLD_IV" -> ("GOLD", "IV"), "Unranked" -> ("Unranked", None) """
+    tier, _, division = (rank or "Unranked").partition("_")
+    return tier, (division or None)
+
+
+def join_rank(tier, division):
+    return f"{tier}_{division}" if division else tier
+
+
+class GameContext:
+    """ Participants and teams of a set of games, indexed in memory for O(1) lookups """
+
+    def __init__(self, participants, teams):
+        self.participants = {}
+        for p in participants:
+            # first row wins, like the query it replaces
+            self.participants.setdefault((p['gameId'], p['teamId'], p['individualPosition']), p)
+        self.teams = {}
+        for t in teams:
+            self.teams.setdefault((t['gameId'], t['teamId']), t)
+
+    def opponent(self, p):
+        """ Lane opponent of a participant: same position in the other team, or None """
+        opponent_team = 200 if p.get('teamId') == 100 else 100
+        position = p.get('individualPosition') or 'UNKNOWN'
+        return self.participants.get((p.get('gameId'), opponent_team, position))
+
+    def team(self, p):
+        """ game_team row of the participant's team, or None """
+        return self.teams.get((p.get('gameId'), p.get('teamId')))
+
+    def win(self, p):
+        team = self.team(p)
+        return bool(team.get('win')) if team else False
+
+
+# Games kept in matchup_stats.recent_form
+RECENT_FORM_SIZE = 5
+
+
+class Rollups:
+    """
+    Changes to the rollup tables (ChampionStats, RoleStats, MatchupStats, OpponentRankStats)
+    accumulated in memory for a set of participant rows, then merged into the tables by write().
+    """
+
+    def __init__(self):
+        # table name -> primary key tuple -> row
+        self.rows = {model.__tablename__: {} for model in ROLLUP_MODELS}
+
+    @staticmethod
+    def _totals(p):
+        return {
+            'kills': p.get('kills') or 0,
+            'deaths': p.get('deaths') or 0,
+            'assists': p.get('assists') or 0,
+            'cs': (p.get('totalMinionsKilled') or 0) + (p.get('neutralMinionsKilled') or 0),
+            'gold': p.get('goldEarned') or 0,
+            'duration': p.get('gameDuration') or 0
+        }
+
+    def add(self, p, context):
+        """ Count the game of participant row p. context: GameContext holding its game """
+        win = context.win(p)
+        end = p.get('gameEndTimestamp') or 0
+        totals = self._totals(p)
+        puuid = p['puuid']
+        # every rollup keys a game with the same spelling of its champions. The position keeps the
+        # spelling its endpoint always returned: stored in /api/role-stats ('Invalid'), uppercased by the lane ones
+        position = p.get('individualPosition') or 'UNKNOWN'
+        champion = p.get('championName') or 'Unknown'
+
+        self._count(ChampionStats, (puuid, champion), totals, win, end)
+        self._count(RoleStats, (puuid, position), totals, win, end)
+        position = position.upper()
+
+        opp = context.opponent(p)
+        if opp is None:
+            return
+        opp_totals = {f'opp_{k}': v for k, v in self._totals(opp).items()}
+        self._count(MatchupStats, (puuid, champion, position, opp.get('championName') or 'Unknown'),
+                    {**totals, **opp_totals}, win, end)
+        self._count(OpponentRankStats, (puuid, p.get('gameMode') or '', position, opp.get('current_rank') or ''),
+                    totals, win, end)
+
+    def _count(self, model, key, totals, win, end):
+        table = model.__table__
+        rows = self.rows[table.name]
+        row = rows.get(key)
+        if row is None:
+            row = rows[key] = self._empty(table, key)
+        row['matches'] += 1
+        row['wins' if win else 'losses'] += 1
+        for column, value in totals.items():
+            if column in row:
+                row[column] += value
+        row['last_game_end'] = max(row['last_game_end'], end)
+        if 'recent_form' in row:
+            row['recent_form'] = self._recent(row['recent_form'], [[end, 'W' if win else 'L']])
+
+    @staticmethod
+    def _empty(table, key):
+        row = dict(zip(table.primary_key.columns.keys(), key))
+        for column in table.columns:
+            if not column.primary_key:
+                row[column.name] = column.default.arg if column.default is not None else None
+        if 'recent_form' in row:
+            row['recent_form'] = []
+        return row
+
+    @staticmethod
+    def _recent(*forms):
+        return sorted((g for form in forms for g in form), key=lambda g: g[0], reverse=True)[:RECENT_FORM_SIZE]
+
+    def _merge(self, row, stored):
+        """ Add the counters of a stored row to a row of changes """
+        for name, value in stored.items():
+            if name == 'last_game_end':
+                row[name] = max(row[name], value)
+            elif name == 'recent_form':
+                row[name] = self._recent(row[name], json.loads(value))
+            elif name not in row or isinstance(value, str):
+                continue
+            else:
+                row[name] += value
+
+    def write(self, conn, upsert, replace=False, chunk_size=500):
+        """
+        Merge the changes into the tables with conn. With replace, the tables are assumed empty.
+        upsert(table): INSERT statement updating the existing row on primary key conflicts
+        """
+        for model in ROLLUP_MODELS:
+            table = model.__table__
+            rows = self.rows[table.name]
+            if not rows:
+                continue
+            keys = list(rows)
+            key_columns = list(table.primary_key.columns)
+            if not replace:
+                for i in range(0, len(keys), chunk_size):
+                    chunk = keys[i:i + chunk_size]
+                    for stored in conn.execute(select(table).where(tuple_(*key_columns).in_(chunk))).mappings():
+                        self._merge(rows[tuple(stored[c.name] for c in key_columns)], stored)
+            values = [{**row, 'recent_form': json.dumps(row['recent_form'])} if 'recent_form' in row else row
+                      for row in rows.values()]
+            conn.execute(upsert(table), values)
+
+
+# Row formats of DatabaseManager.iter_data and fetch_data
+ROW_FORMATS = ('tuple', 'record', 'dict')
+
+
+@lru_cache(maxsize=128)
+def record_type(columns):
+    """ Record class of a tuple of column names: a namedtuple, so rows have no per-instance __dict__ """
+    return namedtuple('Record', columns)
+
+
+# Storage profile of the SQLite database: the dashboard reads while an update writes.
+# WAL lets the readers see the last committed data instead of waiting for the writer,
+# and with WAL, synchronous=NORMAL only syncs at checkpoints (a power loss can lose the last commits, never corrupt)
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size_mb': 64,
+    'mmap_size_mb': 256,
+    'busy_timeout_ms': 5000,
+    'temp_store': 'MEMORY',
+    # pages of WAL after which a commit copies it back into the database file (0 disables it)
+    'wal_autocheckpoint': 1000,
+}
+
+# Values accepted for the text pragmas, since they are formatted into the statement
+SQLITE_PRAGMA_VALUES = {
+    'journal_mode': ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'),
+    'synchronous': ('OFF', 'NORMAL', 'FULL', 'EXTRA'),
+    'temp_store': ('DEFAULT', 'FILE', 'MEMORY'),
+}
+
+CHECKPOINT_MODES = ('PASSIVE', 'FULL', 'RESTART', 'TRUNCATE')
+
+
+def sqlite_pragma_statements(pragmas):
+    """ PRAGMA statements of a storage profile, see SQLITE_PRAGMAS """
+    pragmas = {**SQLITE_PRAGMAS, **(pragmas or {})}
+    for name, allowed in SQLITE_PRAGMA_VALUES.items():
+        pragmas[name] = str(pragmas[name]).upper()
+        if pragmas[name] not in allowed:
+            raise ValueError(f"Invalid value for PRAGMA {name}: {pragmas[name]} (expected one of {', '.join(allowed)})")
+    return [
+        # first, so that switching to WAL waits for the other connections instead of failing
+        f"PRAGMA busy_timeout = {int(pragmas['busy_timeout_ms'])}",
+        f"PRAGMA journal_mode = {pragmas['journal_mode']}",
+        f"PRAGMA synchronous = {pragmas['synchronous']}",
+        # a negative cache_size is in KiB instead of pages
+        f"PRAGMA cache_size = {-int(pragmas['cache_size_mb']) * 1024}",
+        f"PRAGMA mmap_size = {int(pragmas['mmap_size_mb']) * 1024 * 1024}",
+        f"PRAGMA temp_store = {pragmas['temp_store']}",
+        f"PRAGMA wal_autocheckpoint = {int(pragmas['wal_autocheckpoint'])}",
+    ]
+
+
+def apply_sqlite_pragmas(engine, pragmas=None):
+    """ Run the PRAGMA statements on every new connection of the engine (most of them only last for the connection) """
+    statements = sqlite_pragma_statements(pragmas)
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for statement in statements:
+                cursor.execute(statement)
+        finally:
+            cursor.close()
+
+
+def copy_value(column_type, value):
+    """ A value as a field of the CSV format of COPY: NULL is an empty field, text is always quoted """
+    if value is None:
+        return ''
+    if isinstance(column_type, Boolean):
+        return 't' if value else 'f'
+    if isinstance(column_type, Integer):
+        return str(int(value))
+    if isinstance(column_type, DateTime):
+        return value.isoformat()
+    if isinstance(value, bool):
+        # stored as SQLite stores them (firstBloodKill, ... are text columns)
+        value = int(value)
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+# SQLite file used when no database url is configured
+SQLITE_PATH = './.lol_dashboard/lol_data.db'
+
+
 # --- Database setup ---
 class DatabaseManager:
-    def __init__(self):
-        # Use persistent database file in home directory
-        db_path = os.path.expanduser('./.lol_dashboard/lol_data.db')
-        os.makedirs(os.path.dirname(db_path), exist_ok=True)
-        self.engine = create_engine(f'sqlite:///{db_path}')
+    def __init__(self, database_url=None, rank_cache_size=5000, rank_ttl_hours=24, query_log_sample=0.0,
+                 sqlite_pragmas=None, pool_size=8, max_overflow=4, pool_timeout=30):
+        if not database_url:
+            # Use persistent database file in home directory
+            db_path = os.path.expanduser(SQLITE_PATH)
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+            database_url = f'sqlite:///{db_path}'
+        # at most pool_size + max_overflow connections are open; one more thread waits up to pool_timeout seconds
+        self.engine = create_engine(database_url, pool_size=pool_size, max_overflow=max_overflow,
+                                    pool_timeout=pool_timeout,
+                                    # a server may close idle connections
+                                    pool_pre_ping=not database_url.startswith('sqlite'))
+        if self.engine.dialect.name == 'sqlite':
+            apply_sqlite_pragmas(self.engine, sqlite_pragmas)
         self.Session = sessionmaker(bind=self.engine)
-        logger.info(f"Database path: {db_path}")
+        self.rank_cache = RankCache(rank_cache_size, timedelta(hours=rank_ttl_hours))
+        # one lock per puuid being resolved, so that concurrent lookups of the same player make one API call
+        self._rank_locks = {}
+        self._rank_locks_guard = threading.Lock()
+        # share of the fetch_data queries logged at INFO level (every query is logged at DEBUG level)
+        self.query_log_sample = query_log_sample
+        logger.info(f"Database: {self.engine.url.render_as_string(hide_password=True)}")
 
     def create_tables(self):
+        # create_all never changes an existing table: indexes and columns are added by the migrations
+        inspector = inspect(self.engine)
+        # before the split of the participants, game_participants was a table
+        fresh = not (inspector.has_table(GameParticipant.__tablename__) or inspector.has_table(PARTICIPANTS_VIEW))
+        missing_rollups = not inspector.has_table(ChampionStats.__tablename__)
         Base.metadata.create_all(self.engine)
+        run_migrations(self.engine, fresh=fresh)
+        self.create_participants_view()
+        self.seed_player_ranks()
+        if missing_rollups and not fresh:
+            self.rebuild_rollups()
+        if self.fetch_data_version() is None:
+            self.bump_data_version()
+        self._warn_unmigrated_sqlite()
         logger.info("Tables created/verified")
 
+    def _warn_unmigrated_sqlite(self):
+        """ A server database left empty next to a SQLite file: the games of the file are not copied by themselves """
+        if self.engine.dialect.name == 'sqlite' or not os.path.exists(SQLITE_PATH):
+            return
+        if self.fetch_data('summoner', ['id'], limit=1):
+            return
+        logger.warning("!" * 100)
+        logger.warning(f"{self.engine.url.render_as_string(hide_password=True)} is empty, but {SQLITE_PATH} holds a "
+                       f"SQLite database that is no longer used.")
+        logger.warning("Copy it with: python update.py --copy-from-sqlite (or unset DATABASE_URL to keep using it)")
+        logger.warning("!" * 100)
+
+    def copy_from(self, source, chunk_size=1000) -> int:
+        """
+        Copy every table of another database into this one, e.g. the SQLite file into the PostgreSQL server.
+        Both are migrated to the current schema first, and this database must not hold any summoner or game.
+        Rows keep their ids. Returns the number of rows copied, or None if nothing was copied.
+        """
+        source.create_tables()
+        self.create_tables()
+        if self.fetch_data('summoner', ['id'], limit=1) or self.fetch_data(GameParticipant.__tablename__, ['id'], limit=1):
+            logger.error("The target database already holds games, nothing copied")
+            return None
+        copied = 0
+        try:
+            with self.engine.begin() as target:
+                # the data versions stamped by create_tables are replaced by the source ones
+                target.execute(DataVersion.__table__.delete())
+                for table in Base.metadata.sorted_tables:
+                    with source.engine.connect() as conn:
+                        result = conn.execution_options(yield_per=chunk_size).execute(select(table))
+                        for rows in result.mappings().partitions():
+                            self._bulk_insert(target, table, [dict(r) for r in rows])
+                            copied += len(rows)
+                    logger.info(f"Copied {table.name}")
+                if target.dialect.name == 'postgresql':
+                    # the ids were copied: the next ones must come after them
+                    for table in Base.metadata.sorted_tables:
+                        if list(table.primary_key.columns.keys()) == ['id']:
+                            target.execute(text(f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                                                f"COALESCE(MAX(id), 0) + 1, false) FROM \"{table.name}\""))
+        except SQLAlchemyError as e:
+            logger.error(f"copy_from error: {e}")
+            return None
+        logger.info(f"Copied {copied} rows")
+        return copied
+
+    def seed_player_ranks(self):
+        """ Fill an empty player_rank table with the latest rank stored for each player of game_participants """
+        session = self.Session()
+        try:
+            if session.query(PlayerRank.puuid).first() is not None:
+                return
+            rows = (session.query(GameParticipant.puuid, GameParticipant.current_rank, GameParticipant.created_at)
+                    .filter(GameParticipant.gameStatusProcess == 'Normal')
+                    .order_by(GameParticipant.created_at)
+                    .all())
+            latest = {puuid: (rank, created_at) for puuid, rank, created_at in rows if rank}
+            for puuid, (rank, created_at) in latest.items():
+                tier, division = split_rank(rank)
+                session.add(PlayerRank(puuid=puuid, tier=tier, division=division, fetched_at=created_at or datetime.utcnow()))
+            session.commit()
+            if latest:
+                logger.info(f"Seeded player_rank with {len(latest)} players")
+        except SQLAlchemyError as e:
+            session.rollback()
+            logger.error(f"seed_player_ranks error: {e}")
+        finally:
+            session.close()
+
+    def create_participants_view(self):
+        """ Create the game_participants view, joining the core and detail rows of the participants """
+        if PARTICIPANTS_VIEW in inspect(self.engine).get_view_names():
+            return
+        with self.engine.begin() as conn:
+            query = participants_view_query().compile(conn)
+            conn.execute(text(f'CREATE VIEW "{PARTICIPANTS_VIEW}" AS {query}'))
+
+    def drop_participants_view(self):
+        with self.engine.begin() as conn:
+            conn.execute(text(f'DROP VIEW IF EXISTS "{PARTICIPANTS_VIEW}"'))
+
     def delete_tables(self):
+        self.drop_participants_view()
         Base.metadata.drop_all(self.engine)
         logger.info("Tables deleted")
 
+    def reset_game_tables(self):
+        """ Empty the participants, game_team and the rollups, keeping the summoner """
+        self.drop_participants_view()
+        for model in [GameParticipantDetail, GameParticipant, GameTeam] + ROLLUP_MODELS:
+            model.__table__.drop(self.engine, checkfirst=True)
+        Base.metadata.create_all(self.engine)
+        self.create_participants_view()
+        self.bump_data_version()
+        logger.info("Game tables reset")
+
     def get_all_tables(self) -> list:
         """Return list of tables in the connected database."""
         try:
@@ -35,69 +433,131 @@ class DatabaseManager:
             logger.error(f"get_all_tables error: {e}")
             return []
 
-    def fetch_data(self, table_name: str, columns: list = None, filters: dict = None) -> list:
+    def checkpoint(self, mode='PASSIVE'):
         """
-        Generic fetch for any table with column selection.
-        
+        Copy the WAL back into the database file.
+          PASSIVE: copies what it can without waiting for the readers, so the WAL stops growing
+          TRUNCATE: waits for the readers, then empties the WAL file
+        Returns (busy, wal pages, pages copied), or None when the database is not a SQLite database in WAL mode.
+        """
+        mode = mode.upper()
+        if mode not in CHECKPOINT_MODES:
+            raise ValueError(f"Invalid checkpoint mode: {mode} (expected one of {', '.join(CHECKPOINT_MODES)})")
+        if self.engine.dialect.name != 'sqlite':
+            return None
+        try:
+            with self.engine.connect() as conn:
+                if conn.exec_driver_sql("PRAGMA journal_mode").scalar().upper() != 'WAL':
+                    return None
+                busy, log, checkpointed = conn.exec_driver_sql(f"PRAGMA wal_checkpoint({mode})").one()
+        except SQLAlchemyError as e:
+            logger.error(f"Error while checkpointing the database: {e}")
+            return None
+        logger.debug(f"Checkpoint {mode}: {checkpointed}/{log} WAL pages copied{' (busy)' if busy else ''}")
+        return busy, log, checkpointed
+
+    def _log_query(self, query, params):
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Executing query: {query} {params}")
+        elif self.query_log_sample and random.random() < self.query_log_sample:
+            logger.info(f"Executing query (sampled): {query} {params}")
+
+    def iter_data(self, table_name: str, columns, filters: dict = None, order_by: list = None,
+                  limit: int = None, row: str = 'tuple', batch_size: int = 1000):
+        """
+        Stream the rows of a table, batch_size rows at a time, instead of loading the whole result.
+
         Args:
             table_name (str): Name of the table to query
-            columns (list): List of column names to fetch. If None, fetches all columns
+            columns (list): Column names to fetch. Required: pass '*' to explicitly fetch whole rows
             filters (dict): Optional dict of column -> value for WHERE clause
-        
-        Returns:
-            list: List of dicts where keys are column names
+            order_by (list): Optional list of column names, prefixed by "-" for a descending order
+            limit (int): Optional maximum number of rows
+            row (str): 'tuple', 'record' (namedtuple, read by attribute) or 'dict'
+            batch_size (int): Number of rows fetched from the database at a time
+
+        Yields:
+            One row per result, in the requested format
+
+        Examples:
+            # Ids of the games of a summoner
+            game_ids = {game_id for (game_id,) in db.iter_data('game_participants', ['gameId'],
+                                                                  filters={'puuid': puuid})}
+
+            # Totals of a summoner, read by attribute
+            for c in db.iter_data('champion_stats', ['kills', 'deaths'], filters={'puuid': puuid}, row='record'):
+                kda += c.kills / max(1, c.deaths)
+        """
+        if not columns:
+            raise ValueError("columns must list the columns to fetch, or be '*'")
+        if row not in ROW_FORMATS:
+            raise ValueError(f"row must be one of {ROW_FORMATS}")
+
+        # Build SELECT clause with quoted column names
+        select_clause = "*" if columns == '*' else ", ".join([f'"{col}"' for col in columns])
+        query = f'SELECT {select_clause} FROM "{table_name}"'
+        params = {}
+
+        # Add WHERE clause if filters provided with quoted column names
+        if filters:
+            conditions = []
+            for k, v in filters.items():
+                conditions.append(f'"{k}" = :{k}')
+                params[k] = v
+            query += " WHERE " + " AND ".join(conditions)
+
+        if order_by:
+            terms = [f'"{col[1:]}" DESC' if col.startswith('-') else f'"{col}"' for col in order_by]
+            query += " ORDER BY " + ", ".join(terms)
+
+        if limit is not None:
+            query += " LIMIT :_limit"
+            params['_limit'] = int(limit)
+
+        self._log_query(query, params)
+        with self.engine.connect() as conn:
+            result = conn.execution_options(yield_per=batch_size).execute(text(query), params)
+            keys = tuple(result.keys())
+            if row == 'record':
+                make = record_type(keys)._make
+            elif row == 'dict':
+                make = lambda r: dict(zip(keys, r))
+            else:
+                make = tuple
+            for r in result:
+                yield make(r)
+
+    def fetch_data(self, table_name: str, columns, filters: dict = None,
+                   order_by: list = None, limit: int = None, row: str = 'dict') -> list:
+        """
+        Generic fetch for any table with column selection: iter_data, loaded in a list.
+        Returns an empty list if the query fails.
         
         Examples:
             # Fetch all columns from summoner table
-            db.fetch_data('summoner')
+            db.fetch_data('summoner', '*')
             
             # Fetch specific columns
             db.fetch_data('summoner', columns=['summoner_name', 'puuid'])
             
             # Fetch with filter
-            db.fetch_data('summoner', filters={'summoner_name': 'lolEnable'})
+            db.fetch_data('summoner', '*', filters={'summoner_name': 'lolEnable'})
             
-            # Fetch specific columns with filter
+            # Fetch specific columns with filter, as tuples
             db.fetch_data('game_participants', 
                           columns=['championName', 'kills', 'deaths', 'assists'],
-                          filters={'gameId': 'EUW1_0001'})
+                          filters={'gameId': 'EUW1_0001'}, row='tuple')
+
+            # Fetch the 30 most recent games of a summoner
+            db.fetch_data('game_participants', ['gameId', 'kills'], filters={'puuid': puuid},
+                          order_by=['-gameEndTimestamp'], limit=30)
         """
-        session = self.Session()
+        rows = self.iter_data(table_name, columns, filters, order_by, limit, row)
         try:
-            from sqlalchemy import text
-            
-            # Build SELECT clause with quoted column names
-            if columns is None:
-                select_clause = "*"
-            else:
-                select_clause = ", ".join([f'"{col}"' for col in columns])
-            
-            # Build base query
-            query = f'SELECT {select_clause} FROM "{table_name}"'
-            params = {}
-            
-            # Add WHERE clause if filters provided with quoted column names
-            if filters:
-                conditions = []
-                for k, v in filters.items():
-                    conditions.append(f'"{k}" = :{k}')
-                    params[k] = v
-                query += " WHERE " + " AND ".join(conditions)
-            
-            logger.info(f"Executing query: {query}")
-            
-            # Execute query
-            result = session.execute(text(query), params)
-            cols = result.keys()
-            rows = [dict(zip(cols, row)) for row in result.fetchall()]
-            
-            logger.info(f"Fetched {len(rows)} rows from {table_name}")
-            return rows
-        except Exception as e:
+            return list(rows)
+        except SQLAlchemyError as e:
             logger.error(f"fetch_data error for {table_name}: {e}")
             return []
-        finally:
-            session.close()
 
     def insert_summoner(self, data: dict) -> int:
         """
@@ -109,55 +569,267 @@ class DatabaseManager:
             s = Summoner(**{k: v for k, v in data.items() if k in Summoner.__table__.columns.keys()})
             session.add(s)
             session.commit()
-            return 1
         except SQLAlchemyError as e:
             session.rollback()
             logger.error(f"insert_summoner error: {e}")
             return 0
         finally:
             session.close()
+        # games of the new summoner may already be stored (e.g. with a tracked duo partner),
+        # insert_games skips them as already stored: count them in its rollups now
+        self.rebuild_rollups([data.get('puuid')])
+        return 1
 
-    def insert_participants(self, rows: list) -> int:
+    def insert_games(self, games: list) -> int:
         """
-        rows: list of dicts where keys match column names in GameParticipant
+        Insert the participants and teams of a batch of cured games in a single transaction,
+        with one executemany-style insert per table. The rollups of the tracked summoners
+        are updated in the same transaction.
+        games: list of dicts with "participants" and "teams" lists, as built by update.cure_game
+        Returns the number of games inserted (0 if the batch was rolled back).
         """
-        if not isinstance(rows, list):
-            rows = [rows]
-        session = self.Session()
-        inserted = 0
-        valid_cols = set(GameParticipant.__table__.columns.keys())
+        if not games:
+            return 0
+        now = datetime.utcnow()
+        participants = [r for g in games for r in g["participants"]]
+        participant_rows = [self._table_row(GameParticipant, r, now) for r in participants]
+        team_rows = [self._table_row(GameTeam, t, now) for g in games for t in g["teams"]]
         try:
-            for r in rows:
-                filtered = {k: v for k, v in r.items() if k in valid_cols}
-                gp = GameParticipant(**filtered)
-                session.add(gp)
-                inserted += 1
-            session.commit()
-            return inserted
+            with self.engine.begin() as conn:
+                # games already stored must not be counted twice in the rollups
+                game_ids = {r['gameId'] for r in participant_rows}
+                stored = set(conn.execute(select(GameParticipant.gameId.distinct())
+                                          .where(GameParticipant.gameId.in_(game_ids))).scalars())
+                tracked = set(conn.execute(select(Summoner.puuid)).scalars())
+
+                # rows already stored are ignored, so that running an ingest twice is harmless
+                self._bulk_insert(conn, GameParticipant.__table__, participant_rows)
+                self._bulk_insert(conn, GameTeam.__table__, team_rows)
+
+                # like the unique index, keep the first row of a player in a game
+                new_participants, new_details, seen = [], [], set()
+                for r, data in zip(participant_rows, participants):
+                    if r['gameId'] not in stored and (r['gameId'], r['puuid']) not in seen:
+                        seen.add((r['gameId'], r['puuid']))
+                        new_participants.append(r)
+                        new_details.append(self._table_row(GameParticipantDetail, data))
+                self._insert_details(conn, new_participants, new_details)
+                context = GameContext(new_participants, [t for t in team_rows if t['gameId'] not in stored])
+                rollups = Rollups()
+                for r in new_participants:
+                    if r['puuid'] in tracked and r['gameStatusProcess'] == 'Normal':
+                        rollups.add(r, context)
+                rollups.write(conn, self._upsert)
+                if new_participants:
+                    self._bump_data_version(conn, {r['puuid'] for r in new_participants if r['puuid'] in tracked})
+            return len(games)
         except SQLAlchemyError as e:
-            session.rollback()
-            logger.error(f"insert_participants error: {e}")
+            logger.error(f"insert_games error: {e}")
             return 0
+
+    def _insert_details(self, conn, participants, details):
+        """ Insert the detail rows of participant rows just inserted, once their ids are known """
+        if not participants:
+            return
+        core = GameParticipant.__table__
+        ids = {(game_id, puuid): participant_id for participant_id, game_id, puuid in conn.execute(
+            select(core.c.id, core.c.gameId, core.c.puuid).where(core.c.gameId.in_({r['gameId'] for r in participants})))}
+        for r, detail in zip(participants, details):
+            detail['participant_id'] = ids[(r['gameId'], r['puuid'])]
+        self._bulk_insert(conn, GameParticipantDetail.__table__, details)
+
+    def _bulk_insert(self, conn, table, rows):
+        """
+        Insert rows (dicts with the same keys) ignoring the ones already stored, like _insert_or_ignore.
+        On PostgreSQL the rows are sent with COPY into a temporary table, then moved by one INSERT ... SELECT,
+        since COPY cannot skip conflicting rows. Elsewhere, one executemany insert.
+        """
+        if not rows:
+            return
+        if conn.dialect.name != 'postgresql':
+            conn.execute(self._insert_or_ignore(table), rows)
+            return
+
+        stage = f'_copy_{table.name}'
+        columns = list(rows[0])
+        column_list = ", ".join('"' + c + '"' for c in columns)
+        types = [table.c[c].type for c in columns]
+        buffer = io.StringIO()
+        for i, row in enumerate(rows):
+            buffer.write(f"{i}," + ",".join(copy_value(t, row[c]) for t, c in zip(types, columns)) + "\n")
+        buffer.seek(0)
+
+        # the temporary table is dropped with the transaction if anything fails
+        conn.execute(text(f'CREATE TEMPORARY TABLE "{stage}" AS '
+                          f'SELECT 0::bigint AS _row, {column_list} FROM "{table.name}" WITH NO DATA'))
+        cursor = conn.connection.cursor()
+        try:
+            cursor.copy_expert(f'COPY "{stage}" (_row, {column_list}) FROM STDIN WITH (FORMAT csv)', buffer)
         finally:
-            session.close()
+            cursor.close()
+        # in the order of the rows, so that the first row of a player in a game is the one kept
+        conn.execute(text(f'INSERT INTO "{table.name}" ({column_list}) '
+                          f'SELECT {column_list} FROM "{stage}" ORDER BY _row ON CONFLICT DO NOTHING'))
+        conn.execute(text(f'DROP TABLE "{stage}"'))
+
+    def _insert_or_ignore(self, table):
+        dialect = self.engine.dialect.name
+        if dialect == 'sqlite':
+            return sqlite.insert(table).on_conflict_do_nothing()
+        if dialect == 'postgresql':
+            return postgresql.insert(table).on_conflict_do_nothing()
+        return table.insert()
+
+    def _upsert(self, table):
+        dialect = self.engine.dialect.name
+        if dialect == 'sqlite':
+            stmt = sqlite.insert(table)
+        elif dialect == 'postgresql':
+            stmt = postgresql.insert(table)
+        else:
+            return table.insert()
+        return stmt.on_conflict_do_update(index_elements=list(table.primary_key.columns),
+                                          set_={c.name: stmt.excluded[c.name] for c in table.columns if not c.primary_key})
+
+    def _bump_data_version(self, conn, puuids):
+        now = datetime.utcnow()
+        rows = [{'puuid': puuid, 'version': uuid.uuid4().hex, 'updated_at': now}
+                for puuid in set(puuids) | {GLOBAL_VERSION}]
+        conn.execute(self._upsert(DataVersion.__table__), rows)
+
+    def bump_data_version(self, puuids=None):
+        """ Change the data version of the given summoners, of every summoner if None, and the global one """
+        try:
+            with self.engine.begin() as conn:
+                if puuids is None:
+                    puuids = conn.execute(select(Summoner.puuid)).scalars().all()
+                self._bump_data_version(conn, puuids)
+        except SQLAlchemyError as e:
+            logger.error(f"bump_data_version error: {e}")
 
-    def insert_team(self, data: dict) -> int:
+    def fetch_data_version(self, puuid=None):
         """
-        data example: dict with keys of GameTeam
+        Data version of a summoner, or the global one for a puuid that is not tracked (or None).
+        Returns None if there is no version yet.
         """
-        session = self.Session()
         try:
-            filtered = {k: v for k, v in data.items() if k in GameTeam.__table__.columns.keys()}
-            gt = GameTeam(**filtered)
-            session.add(gt)
-            session.commit()
-            return 1
+            with self.engine.connect() as conn:
+                versions = dict(conn.execute(select(DataVersion.puuid, DataVersion.version)
+                                             .where(DataVersion.puuid.in_({puuid or GLOBAL_VERSION, GLOBAL_VERSION}))).all())
+            return versions.get(puuid) or versions.get(GLOBAL_VERSION)
         except SQLAlchemyError as e:
-            session.rollback()
-            logger.error(f"insert_team error: {e}")
+            logger.error(f"fetch_data_version error: {e}")
+            return None
+
+    def rebuild_rollups(self, puuids=None, chunk_size=500):
+        """ Recompute the rollup tables from game_participants and game_team, for every tracked summoner or the given ones """
+        participants = GameParticipant.__table__
+        rollups = Rollups()
+        try:
+            with self.engine.connect() as conn:
+                tracked = list(conn.execute(select(Summoner.puuid)).scalars())
+                if puuids is not None:
+                    tracked = [puuid for puuid in tracked if puuid in set(puuids)]
+                game_ids = list(conn.execute(select(participants.c.gameId.distinct())
+                                             .where(participants.c.puuid.in_(tracked))).scalars())
+                for i in range(0, len(game_ids), chunk_size):
+                    chunk = game_ids[i:i + chunk_size]
+                    context = self.load_game_context(chunk)
+                    rows = conn.execute(select(participants)
+                                        .where(participants.c.gameId.in_(chunk),
+                                               participants.c.puuid.in_(tracked),
+                                               participants.c.gameStatusProcess == 'Normal')).mappings()
+                    for r in rows:
+                        rollups.add(r, context)
+
+            with self.engine.begin() as conn:
+                for model in ROLLUP_MODELS:
+                    delete = model.__table__.delete()
+                    if puuids is not None:
+                        delete = delete.where(model.__table__.c.puuid.in_(tracked))
+                    conn.execute(delete)
+                rollups.write(conn, self._upsert, replace=True)
+            self.bump_data_version(puuids)
+            logger.info(f"Rollups rebuilt from {len(game_ids)} games")
+            return len(game_ids)
+        except SQLAlchemyError as e:
+            logger.error(f"rebuild_rollups error: {e}")
             return 0
-        finally:
-            session.close()
+
+    def _table_row(self, model, data, created_at=None):
+        # executemany needs the same keys in every row: missing columns are inserted as NULL
+        row = {c: data.get(c) for c in model.__table__.columns.keys() if c not in ('id', 'created_at')}
+        if 'created_at' in model.__table__.columns:
+            row['created_at'] = created_at
+        return row
+
+    def load_game_context(self, game_ids, chunk_size=500, details=False) -> GameContext:
+        """
+        Load every participant and team of the given games, with one query per table
+        for each chunk of chunk_size games (instead of one query per game).
+        details: full participant rows (game_participants view) instead of the core columns
+        """
+        game_ids = list(dict.fromkeys(g for g in game_ids if g is not None))
+        participants_table = participants_view if details else GameParticipant.__table__
+        teams_table = GameTeam.__table__
+        participants, teams = [], []
+        try:
+            with self.engine.connect() as conn:
+                for i in range(0, len(game_ids), chunk_size):
+                    chunk = game_ids[i:i + chunk_size]
+                    participants.extend(dict(r) for r in conn.execute(
+                        select(participants_table).where(participants_table.c.gameId.in_(chunk))
+                        .order_by(participants_table.c.id)).mappings())
+                    teams.extend(dict(r) for r in conn.execute(
+                        select(teams_table).where(teams_table.c.gameId.in_(chunk))
+                        .order_by(teams_table.c.id)).mappings())
+        except SQLAlchemyError as e:
+            logger.error(f"load_game_context error: {e}")
+        return GameContext(participants, teams)
+
+    def fetch_match_page(self, puuid, gameMode=None, position=None, limit=10, offset=0, after=None,
+                         with_total=True, gameStatusProcess='Normal'):
+        """
+        One page of the games of a summoner, most recent first, filtered, sorted and limited in SQL.
+          after: (gameEndTimestamp, gameId) of the last row of the previous page. The page then starts
+                 right after it (keyset pagination, served by ix_participant_core_puuid_status_end_game)
+                 and offset is ignored.
+          with_total: also count the games matching the filters, in a separate COUNT query
+        Returns (rows, total), total being None when with_total is False. The rows are full participant rows,
+        the count only reads the core table.
+        """
+        core = GameParticipant.__table__
+        conditions = [core.c.puuid == puuid]
+        if gameStatusProcess is not None:
+            conditions.append(core.c.gameStatusProcess == gameStatusProcess)
+        if gameMode is not None:
+            conditions.append(core.c.gameMode == gameMode)
+        if position is not None:
+            conditions.append(core.c.individualPosition == position)
+
+        # the page is found in the core table, then only its rows are joined with their details
+        page = (select(core.c.id).where(*conditions)
+                .order_by(core.c.gameEndTimestamp.desc(), core.c.gameId.desc())
+                .limit(limit))
+        if after is not None:
+            end, game_id = after
+            page = page.where((core.c.gameEndTimestamp < end) |
+                              and_(core.c.gameEndTimestamp == end, core.c.gameId < game_id))
+        elif offset:
+            page = page.offset(offset)
+        query = (select(participants_view).where(participants_view.c.id.in_(page.scalar_subquery()))
+                 .order_by(participants_view.c.gameEndTimestamp.desc(), participants_view.c.gameId.desc()))
+
+        try:
+            with self.engine.connect() as conn:
+                rows = [dict(r) for r in conn.execute(query).mappings()]
+                total = None
+                if with_total:
+                    total = conn.execute(select(func.count()).select_from(core).where(*conditions)).scalar()
+                return rows, total
+        except SQLAlchemyError as e:
+            logger.error(f"fetch_match_page error: {e}")
+            return [], 0 if with_total else None
 
     def fetch_summoners(self) -> list:
         session = self.Session()
@@ -167,14 +839,12 @@ class DatabaseManager:
             session.close()
 
     def fetch_participants(self, gameId=None) -> list:
-        session = self.Session()
-        try:
-            q = session.query(GameParticipant)
-            if gameId is not None:
-                q = q.filter(GameParticipant.gameId == str(gameId))
-            return [self._row_to_dict(r) for r in q.all()]
-        finally:
-            session.close()
+        """ Full participant rows, read from the game_participants view """
+        query = select(participants_view)
+        if gameId is not None:
+            query = query.where(participants_view.c.gameId == str(gameId))
+        with self.engine.connect() as conn:
+            return [dict(r) for r in conn.execute(query).mappings()]
 
     def fetch_teams(self, gameId=None) -> list:
         session = self.Session()
@@ -191,7 +861,7 @@ class DatabaseManager:
     
     """ Fetch the main summoner from the db """
     def fetch_main_summoner(self):
-        summoner = self.fetch_data('summoner')
+        summoner = self.fetch_data('summoner', ['puuid'])
         if summoner == []:
             logger.info("No summoner found in database")
             return False
@@ -199,49 +869,138 @@ class DatabaseManager:
             logger.info("Summoner found in database")
             return True
     
-    """ Clean an array of games Id to remove those already stored in the db """
+    """ Clean an array of games Id to remove those already stored in the db.
+     Return None if the check failed: an empty list would read as "every game is stored" """
     def remove_already_stored_games(self, all_games_id, puuid):
-        gameStored = self.fetch_data('game_participants', columns=['gameId'], filters={'puuid': puuid})
-        gameStored = [game['gameId'] for game in gameStored]
-        gameNotStoredYet = [x for x in all_games_id if x not in gameStored]
-        
-        return gameNotStoredYet
+        if not all_games_id:
+            return []
+        # duplicated ids are dropped, the order of the first occurrences is kept
+        candidates = [{'gameId': g, 'position': i} for i, g in enumerate(dict.fromkeys(all_games_id))]
+        participants = GameParticipant.__table__
+        try:
+            with self.engine.begin() as conn:
+                candidate_games.create(conn, checkfirst=True)
+                conn.execute(candidate_games.delete())
+                conn.execute(candidate_games.insert(), candidates)
+                # anti-join on the (gameId, puuid) unique index
+                stored = exists().where(and_(participants.c.gameId == candidate_games.c.gameId,
+                                             participants.c.puuid == puuid))
+                rows = conn.execute(select(candidate_games.c.gameId)
+                                    .where(~stored)
+                                    .order_by(candidate_games.c.position))
+                gameNotStoredYet = [r[0] for r in rows]
+                conn.execute(candidate_games.delete())
+            return gameNotStoredYet
+        except SQLAlchemyError as e:
+            logger.error(f"remove_already_stored_games error: {e}")
+            return None
     
-    """ Fetch the rank of the summoner in the db. Return [] if he does not exist """
+    """ Fetch the sync cursor of a summoner: the gameEndTimestamp (ms) of the newest game fully synced, or None """
+    def fetch_sync_cursor(self, puuid):
+        session = self.Session()
+        try:
+            row = session.get(SummonerSync, puuid)
+            return row.last_game_end if row is not None else None
+        finally:
+            session.close()
+
+    """ Move the sync cursor of a summoner to the newest game stored for him """
+    def save_sync_cursor(self, puuid):
+        session = self.Session()
+        try:
+            newest = (session.query(func.max(GameParticipant.gameEndTimestamp))
+                      .filter(GameParticipant.puuid == puuid)
+                      .scalar())
+            if newest is None:
+                return None
+            session.merge(SummonerSync(puuid=puuid, last_game_end=newest, synced_at=datetime.utcnow()))
+            session.commit()
+            return newest
+        except SQLAlchemyError as e:
+            session.rollback()
+            logger.error(f"save_sync_cursor error: {e}")
+            return None
+        finally:
+            session.close()
+
+    """ Fetch the cached rank of a player in the db. Return None if he is not cached or if his rank expired """
     def fetch_summoner_rank(self, puuid):
-        return self.fetch_data('game_participants', columns=['current_rank'], filters={'puuid': puuid})
-    
-    """ Set the summoner's rank, either from getting from the bd or the API """
+        session = self.Session()
+        try:
+            row = session.get(PlayerRank, puuid)
+            if row is None or datetime.utcnow() - row.fetched_at > self.rank_cache.ttl:
+                return None
+            return join_rank(row.tier, row.division), row.fetched_at
+        finally:
+            session.close()
+
+    """ Save the rank of a player in the player_rank cache """
+    def save_summoner_rank(self, puuid, rank, fetched_at):
+        tier, division = split_rank(rank)
+        session = self.Session()
+        try:
+            session.merge(PlayerRank(puuid=puuid, tier=tier, division=division, fetched_at=fetched_at))
+            session.commit()
+        except SQLAlchemyError as e:
+            session.rollback()
+            logger.error(f"save_summoner_rank error: {e}")
+        finally:
+            session.close()
+
+    """ Set the summoner's rank, from the in-process cache, then the player_rank table, then the API """
     def set_summoner_rank(self, user_config, url_config, api, puuid):
-        # we look if the summoner is already in the database
-        summoner = self.fetch_summoner_rank(puuid)
+        rank = self.rank_cache.get(puuid)
+        if rank is not None:
+            return rank
 
-        # if not, we fetch the rank from the Riot API
-        if summoner == []:
-            return api.fetch_summoner_rank(url_config, user_config, puuid)
+        with self._rank_locks_guard:
+            lock = self._rank_locks.setdefault(puuid, threading.Lock())
 
-        # if yes, we return the rank stored in the database
-        else:
-            return summoner[0]["current_rank"]
+        try:
+            with lock:
+                # another thread may have resolved it while we were waiting
+                rank = self.rank_cache.get(puuid)
+                if rank is not None:
+                    return rank
+
+                cached = self.fetch_summoner_rank(puuid)
+                if cached is not None:
+                    rank, fetched_at = cached
+                    self.rank_cache.put(puuid, rank, fetched_at)
+                    return rank
+
+                rank = api.fetch_summoner_rank(url_config, user_config, puuid)
+                if rank is None:
+                    # the request failed, do not cache anything
+                    return "Unranked"
+                fetched_at = datetime.utcnow()
+                self.save_summoner_rank(puuid, rank, fetched_at)
+                self.rank_cache.put(puuid, rank, fetched_at)
+                return rank
+        finally:
+            with self._rank_locks_guard:
+                self._rank_locks.pop(puuid, None)
         
-    """ Cure the team data from the API before inserting it in db """
-    def cure_team_data(self, gameData, useful_data, n):
+    """ Cure the team data from the API before inserting it in db.
+     game_id is the match id ("EUW1_1234", "NA1_5678", ...), the gameId of the participants of the game. """
+    def cure_team_data(self, gameData, useful_data, n, game_id):
 
         cured_team = {x: gameData[x] for x in useful_data["team_data"] if x in gameData}
         tmp = {x: gameData["teams"][n]["objectives"][x]["kills"] for x in useful_data["objectives_data"] if x in gameData["teams"][n]["objectives"]}
         cured_team.update(tmp)
 
         cured_team["teamId"] = gameData["teams"][n]["teamId"]
-        cured_team["win"] = gameData["teams"][n]["win"]
-        cured_team["gameId"] = "EUW1_" + str(cured_team["gameId"])
+        cured_team["gameId"] = game_id
 
-        if gameData["participants"][0]["gameEndedInEarlySurrender"]:
-            cured_team["win"] = "Remake"
+        # a remake is neither a win nor a loss
+        cured_team["remake"] = bool(gameData["participants"][0]["gameEndedInEarlySurrender"])
+        cured_team["win"] = bool(gameData["teams"][n]["win"]) and not cured_team["remake"]
 
         return cured_team
     
-    """ Cure the participant data from the API before inserting it in db """
-    def cure_participants_data(self, participants, additional_info, summoner, user_config, url_config, useful_data, api):
+    """ Cure the participant data from the API before inserting it in db.
+     When ranks (puuid -> rank) is given, ranks are read from it instead of the db or the API. """
+    def cure_participants_data(self, participants, additional_info, summoner, user_config, url_config, useful_data, api, ranks=None):
 
         cured_participants = []
 
@@ -273,7 +1032,9 @@ class DatabaseManager:
                 cured_participant["gameStatusProcess"] = "Normal"
 
                 # Get summoner's rank
-                if cured_participant["puuid"] == summoner["puuid"]:
+                if ranks is not None:
+                    participant_rank = ranks.get(cured_participant["puuid"], "Unranked")
+                elif cured_participant["puuid"] == summoner["puuid"]:
                     participant_rank = summoner["current_rank"]
                 else:
                     participant_rank = self.set_summoner_rank(user_config, url_config, api, participant["puuid"])
@@ -318,23 +1079,46 @@ class Summoner(Base):
     current_rank = Column(String(100))
     created_at = Column(DateTime, default=datetime.utcnow)
 
+# Participants are split in two tables joined on the participant id:
+#   - game_participant_core: the columns read by the dashboard scans, a few pages per thousand games
+#   - game_participant_detail: the other columns (pings, damages, items, ...), read one game at a time
+# The game_participants view (participants_view) joins them back into the full rows.
 class GameParticipant(Base):
-    __tablename__ = 'game_participants'
+    __tablename__ = 'game_participant_core'
     id = Column(Integer, primary_key=True)
-    gameId = Column(String(64), nullable=False, index=True)
-    gameEndTimestamp = Column(String(64), nullable=False)
-    gameDuration = Column(String(64), nullable=False)
+    # indexed by uq_participant_core_game_puuid
+    gameId = Column(String(64), nullable=False)
+    # epoch milliseconds
+    gameEndTimestamp = Column(BigInteger, nullable=False)
+    # seconds
+    gameDuration = Column(Integer, nullable=False)
     gameMode = Column(String(64))
     gameStatusProcess = Column(String(64))
     puuid = Column(String(200), nullable=False)
     championName = Column(String(100))
-    champExperience = Column(Integer)
-    champLevel = Column(Integer)
     individualPosition = Column(String(50))
     teamId = Column(Integer)
     deaths = Column(Integer)
     kills = Column(Integer)
     assists = Column(Integer)
+    goldEarned = Column(Integer)
+    totalMinionsKilled = Column(Integer)
+    neutralMinionsKilled = Column(Integer)
+    current_rank = Column(String(100))
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+Index('uq_participant_core_game_puuid', GameParticipant.gameId, GameParticipant.puuid, unique=True)
+# dashboard queries: a summoner's games, filtered on gameStatusProcess and sorted by date then gameId (match list keyset)
+Index('ix_participant_core_puuid_status_end_game', GameParticipant.puuid, GameParticipant.gameStatusProcess,
+      GameParticipant.gameEndTimestamp, GameParticipant.gameId)
+# lane opponent lookups
+Index('ix_participant_core_game_team_position', GameParticipant.gameId, GameParticipant.teamId, GameParticipant.individualPosition)
+
+class GameParticipantDetail(Base):
+    __tablename__ = 'game_participant_detail'
+    participant_id = Column(Integer, ForeignKey('game_participant_core.id'), primary_key=True)
+    champExperience = Column(Integer)
+    champLevel = Column(Integer)
     allInPings = Column(Integer)
     assistMePings = Column(Integer)
     basicPings = Column(Integer)
@@ -387,26 +1171,49 @@ class GameParticipant(Base):
     summoner2Id = Column(Integer)
     totalTimeSpentDead = Column(Integer)
     longestTimeSpentLiving = Column(Integer)
-    goldEarned = Column(Integer)
-    totalMinionsKilled = Column(Integer)
     totalAllyJungleMinionsKilled = Column(Integer)
     totalEnemyJungleMinionsKilled = Column(Integer)
-    neutralMinionsKilled = Column(Integer)
     timeCCingOthers = Column(Integer)
     totalTimeCCDealt = Column(Integer)
-    current_rank = Column(String(100))
     item0 = Column(Integer)
     item1 = Column(Integer)
     item2 = Column(Integer)
     item3 = Column(Integer)
     item4 = Column(Integer)
     item5 = Column(Integer)
-    created_at = Column(DateTime, default=datetime.utcnow)
+
+PARTICIPANTS_VIEW = 'game_participants'
+
+
+def participants_view_query():
+    """ SELECT of the game_participants view: every core column, then every detail column """
+    core, detail = GameParticipant.__table__, GameParticipantDetail.__table__
+    return (select(*core.columns, *[c for c in detail.columns if c.name != 'participant_id'])
+            .select_from(core.outerjoin(detail, detail.c.participant_id == core.c.id)))
+
+# The view as a table, to query it. Kept apart from the models metadata: create_all must not create it
+participants_view = Table(PARTICIPANTS_VIEW, MetaData(),
+                          *[Column(c.name, c.type, primary_key=c.name == 'id')
+                            for c in participants_view_query().selected_columns])
+
+class SummonerSync(Base):
+    __tablename__ = 'summoner_sync'
+    puuid = Column(String(200), primary_key=True)
+    last_game_end = Column(BigInteger, nullable=False)
+    synced_at = Column(DateTime, default=datetime.utcnow)
+
+class PlayerRank(Base):
+    __tablename__ = 'player_rank'
+    puuid = Column(String(200), primary_key=True)
+    tier = Column(String(50), nullable=False)
+    division = Column(String(10))
+    fetched_at = Column(DateTime, nullable=False, default=datetime.utcnow)
 
 class GameTeam(Base):
     __tablename__ = 'game_team'
     id = Column(Integer, primary_key=True)
-    gameId = Column(String(64), nullable=False, index=True)
+    # indexed by uq_team_game_team
+    gameId = Column(String(64), nullable=False)
     gameMode = Column(String(100))
     gameType = Column(String(100))
     gameVersion = Column(String(100))
@@ -420,9 +1227,99 @@ class GameTeam(Base):
     riftHerald = Column(Integer)
     tower = Column(Integer)
     teamId = Column(Integer)
-    win = Column(String(20))
+    win = Column(Boolean)
+    remake = Column(Boolean)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+Index('uq_team_game_team', GameTeam.gameId, GameTeam.teamId, unique=True)
+
+# Version of the data of a summoner, changed by every write that affects its games.
+# The row of GLOBAL_VERSION changes with any write
+class DataVersion(Base):
+    __tablename__ = 'data_version'
+    puuid = Column(String(200), primary_key=True)
+    # random token, so that a version is never reused, even after the tables are dropped
+    version = Column(String(32), nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+GLOBAL_VERSION = ''
+
+# --- Rollups ---
+# Per-summoner aggregates of the "Normal" games of the tracked summoners, maintained by insert_games.
+# last_game_end (epoch ms of the most recent game) orders groups with as many matches
+class ChampionStats(Base):
+    __tablename__ = 'champion_stats'
+    puuid = Column(String(200), primary_key=True)
+    championName = Column(String(100), primary_key=True)
+    matches = Column(Integer, nullable=False, default=0)
+    wins = Column(Integer, nullable=False, default=0)
+    losses = Column(Integer, nullable=False, default=0)
+    kills = Column(Integer, nullable=False, default=0)
+    deaths = Column(Integer, nullable=False, default=0)
+    assists = Column(Integer, nullable=False, default=0)
+    cs = Column(Integer, nullable=False, default=0)
+    duration = Column(Integer, nullable=False, default=0)
+    last_game_end = Column(BigInteger, nullable=False, default=0)
+
+class RoleStats(Base):
+    __tablename__ = 'role_stats'
+    puuid = Column(String(200), primary_key=True)
+    individualPosition = Column(String(50), primary_key=True)
+    matches = Column(Integer, nullable=False, default=0)
+    wins = Column(Integer, nullable=False, default=0)
+    losses = Column(Integer, nullable=False, default=0)
+    last_game_end = Column(BigInteger, nullable=False, default=0)
+
+class MatchupStats(Base):
+    __tablename__ = 'matchup_stats'
+    puuid = Column(String(200), primary_key=True)
+    championName = Column(String(100), primary_key=True)
+    individualPosition = Column(String(50), primary_key=True)
+    opponentChampionName = Column(String(100), primary_key=True)
+    matches = Column(Integer, nullable=False, default=0)
+    wins = Column(Integer, nullable=False, default=0)
+    losses = Column(Integer, nullable=False, default=0)
+    kills = Column(Integer, nullable=False, default=0)
+    deaths = Column(Integer, nullable=False, default=0)
+    assists = Column(Integer, nullable=False, default=0)
+    cs = Column(Integer, nullable=False, default=0)
+    gold = Column(Integer, nullable=False, default=0)
+    opp_kills = Column(Integer, nullable=False, default=0)
+    opp_deaths = Column(Integer, nullable=False, default=0)
+    opp_assists = Column(Integer, nullable=False, default=0)
+    opp_cs = Column(Integer, nullable=False, default=0)
+    opp_gold = Column(Integer, nullable=False, default=0)
+    duration = Column(Integer, nullable=False, default=0)
+    last_game_end = Column(BigInteger, nullable=False, default=0)
+    # JSON list of the [gameEndTimestamp, "W" or "L"] of the most recent games, newest first
+    recent_form = Column(String(200), nullable=False, default='[]')
+
+class OpponentRankStats(Base):
+    __tablename__ = 'opponent_rank_stats'
+    puuid = Column(String(200), primary_key=True)
+    gameMode = Column(String(64), primary_key=True)
+    individualPosition = Column(String(50), primary_key=True)
+    # current_rank of the lane opponent, "" when unknown
+    opponentRank = Column(String(100), primary_key=True)
+    matches = Column(Integer, nullable=False, default=0)
+    wins = Column(Integer, nullable=False, default=0)
+    losses = Column(Integer, nullable=False, default=0)
+    kills = Column(Integer, nullable=False, default=0)
+    deaths = Column(Integer, nullable=False, default=0)
+    assists = Column(Integer, nullable=False, default=0)
+    cs = Column(Integer, nullable=False, default=0)
+    gold = Column(Integer, nullable=False, default=0)
+    duration = Column(Integer, nullable=False, default=0)
+    last_game_end = Column(BigInteger, nullable=False, default=0)
+
+ROLLUP_MODELS = [ChampionStats, RoleStats, MatchupStats, OpponentRankStats]
+
+# Candidate ids of remove_already_stored_games. Temporary, so every connection has its own
+candidate_games = Table('candidate_games', MetaData(),
+                        Column('gameId', String(64), primary_key=True),
+                        Column('position', Integer, nullable=False),
+                        prefixes=['TEMPORARY'])
+
 # If run directly, create tables
 if __name__ == '__main__':
     DatabaseManager().create_tables()
@@ -0,0 +1,31 @@
+"""
+Worker process of an ingest job, started by jobs.JobManager:
+
+    python ingest_worker.py [--full]
+
+It only imports the ingest modules, never the dashboard. The progress events of update.main are
+written to stdout, one JSON object per line; everything else printed goes to stderr.
+"""
+import argparse
+import json
+import sys
+
+
+def main(full_sync=False):
+    events = sys.stdout
+    # keep stdout for the events: a stray print must not be read as one
+    sys.stdout = sys.stderr
+
+    def publish(event):
+        events.write(json.dumps(event) + '\n')
+        events.flush()
+
+    from update import main as update
+    update(full_sync=full_sync, progress=publish)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run one database update and stream its progress events")
+    parser.add_argument('--full', action='store_true', help="list the whole match history instead of the games since the last update")
+    args = parser.parse_args()
+    main(full_sync=args.full)
@@ -0,0 +1,183 @@
+import json
+import logging
+import os
+import queue
+import subprocess
+import sys
+import threading
+import uuid
+from datetime import datetime
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Finished jobs kept in memory so that their status can still be polled
+MAX_FINISHED_JOBS = 50
+
+
+WORKER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ingest_worker.py')
+
+
+def worker_command(full_sync=False):
+    """ Command line of the worker process of a job. It runs ingest_worker.py, not this process' main module """
+    command = [sys.executable, WORKER]
+    if full_sync:
+        command.append('--full')
+    return command
+
+
+class IngestJob:
+    """ One database update, run in its own worker process """
+
+    def __init__(self, summoner_key, full_sync=False):
+        self.id = uuid.uuid4().hex
+        self.summoner_key = summoner_key
+        self.full_sync = full_sync
+        self.status = 'queued'
+        self.error = None
+        self.created_at = datetime.utcnow()
+        self.started_at = None
+        self.finished_at = None
+        self.process = None
+
+    @property
+    def active(self):
+        return self.status in ('queued', 'running')
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'summoner': self.summoner_key,
+            'full_sync': self.full_sync,
+            'status': self.status,
+            'error': self.error,
+            'created_at': self.created_at.isoformat(),
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+
+class JobManager:
+    """
+    Queue of ingest jobs, run one at a time (SQLite has a single writer) by a dispatcher thread.
+    Each job runs in a separate process (ingest_worker.py), so that the ingest never competes with the dashboard
+    for the GIL. The worker only imports the ingest modules: the dashboard startup is not run again for every job.
+    A summoner can only have one queued or running job at a time.
+    """
+
+    def __init__(self, command=worker_command, channel=None):
+        # command(full_sync) -> command line of the worker process
+        self.command = command
+        # ProgressChannel receiving the progress events of the running job
+        self.channel = channel
+        self._jobs = {}
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._dispatcher = None
+
+    def submit(self, summoner_key, full_sync=False):
+        """ Queue an ingest for the summoner. Returns (job, created): an active job of the summoner is reused """
+        with self._lock:
+            for job in self._jobs.values():
+                if job.summoner_key == summoner_key and job.active:
+                    return job, False
+            job = IngestJob(summoner_key, full_sync)
+            self._jobs[job.id] = job
+            self._prune()
+            if self._dispatcher is None or not self._dispatcher.is_alive():
+                self._dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+                self._dispatcher.start()
+        self._queue.put(job)
+        self._publish(job, {'status': 'queued', 'percent': 0, 'message': 'Update queued ...'})
+        logger.info(f"Ingest job {job.id} queued for {summoner_key}")
+        return job, True
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda j: j.created_at, reverse=True)
+
+    def cancel(self, job_id):
+        """ Cancel a queued job, or stop a running one. Returns the job, or None if unknown """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or not job.active:
+                return job
+            if job.status == 'queued':
+                job.status = 'cancelled'
+                job.finished_at = datetime.utcnow()
+            elif job.process is not None:
+                # the open transaction is rolled back by SQLite, committed batches are kept
+                job.status = 'cancelled'
+                job.process.terminate()
+        self._publish(job, {'status': 'cancelled', 'percent': 100, 'message': 'Update cancelled'})
+        logger.info(f"Ingest job {job_id} cancelled")
+        return job
+
+    def _publish(self, job, event):
+        if self.channel is not None:
+            self.channel.publish({**event, 'job_id': job.id})
+
+    def _prune(self):
+        finished = [j for j in self._jobs.values() if not j.active]
+        finished.sort(key=lambda j: j.created_at)
+        for job in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job.id]
+
+    def _dispatch(self):
+        while True:
+            job = self._queue.get()
+            with self._lock:
+                if job.status != 'queued':
+                    continue
+                job.status = 'running'
+                job.started_at = datetime.utcnow()
+                try:
+                    # a new process, not a fork: forking the threaded web server would copy its locks and open connections
+                    job.process = subprocess.Popen(self.command(job.full_sync), stdout=subprocess.PIPE, text=True)
+                except Exception as e:
+                    job.status = 'failed'
+                    job.error = f"Worker could not be started: {e}"
+                    job.finished_at = datetime.utcnow()
+                    job.process = None
+            if job.process is None:
+                logger.error(f"Ingest job {job.id} failed: {job.error}")
+                self._publish(job, {'status': 'failed', 'percent': 100, 'message': 'Update failed'})
+                continue
+            logger.info(f"Ingest job {job.id} started (pid {job.process.pid})")
+
+            try:
+                self._pump(job)
+            except Exception as e:
+                logger.error(f"Ingest job {job.id}: lost the worker events, stopping it: {e}")
+                job.process.kill()
+                job.process.wait()
+
+            with self._lock:
+                job.finished_at = datetime.utcnow()
+                if job.status == 'running':
+                    if job.process.returncode == 0:
+                        job.status = 'done'
+                    else:
+                        job.status = 'failed'
+                        job.error = f"Worker exited with code {job.process.returncode}"
+                        self._publish(job, {'status': 'failed', 'percent': 100, 'message': 'Update failed'})
+                job.process = None
+            logger.info(f"Ingest job {job.id} {job.status}")
+
+    def _pump(self, job):
+        """ Forward the events of the worker (JSON lines on its stdout) to the channel until it exits """
+        process = job.process
+        with process.stdout:
+            for line in process.stdout:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    logger.warning(f"Ingest job {job.id} sent an invalid event: {line.strip()}")
+                    continue
+                if job.status == 'running':
+                    self._publish(job, event)
+        process.wait()
@@ -0,0 +1,98 @@
+import os
+import json
+import zlib
+import logging
+import threading
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class MatchStore:
+    """
+    Append-only store of the raw match payloads fetched from the RIOT API.
+
+    Every payload is saved as zlib compressed JSON at the end of a pack file,
+    and an index file maps each match id to its offset and length in the pack.
+    The pack is written before the index, so a crash can leave unused bytes at
+    the end of the pack but never an index entry pointing to a partial record.
+    """
+
+    def __init__(self, directory='./.lol_dashboard'):
+        os.makedirs(directory, exist_ok=True)
+        self.pack_path = os.path.join(directory, 'matches.pack')
+        self.index_path = os.path.join(directory, 'matches.idx')
+        self._lock = threading.Lock()
+        self._index = self._load_index()
+        logger.info(f"Match store: {len(self._index)} games in {self.pack_path}")
+
+    def _load_index(self):
+        index = {}
+        if not os.path.exists(self.index_path):
+            return index
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    match_id, offset, length = line.rstrip('\n').split('\t')
+                    index[match_id] = (int(offset), int(length))
+                except ValueError:
+                    logger.warning(f"Ignoring malformed line in {self.index_path}: {line!r}")
+        return index
+
+    def __contains__(self, match_id):
+        return match_id in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def put(self, match_id, payload):
+        """ Append a payload to the store. A match id already stored is left untouched """
+        return self.put_many([(match_id, payload)]) == 1
+
+    def put_many(self, games):
+        """
+        Append the payloads of (match_id, payload) pairs, with a single fsync for the whole batch.
+        Match ids already stored are left untouched. Returns the number of payloads appended.
+        """
+        records = [(match_id, zlib.compress(json.dumps(payload, separators=(',', ':')).encode('utf-8')))
+                   for match_id, payload in games]
+        with self._lock:
+            new = {}
+            for match_id, data in records:
+                if match_id not in self._index and match_id not in new:
+                    new[match_id] = data
+            if not new:
+                return 0
+            entries = {}
+            with open(self.pack_path, 'ab') as pack:
+                offset = pack.tell()
+                for match_id, data in new.items():
+                    pack.write(data)
+                    entries[match_id] = (offset, len(data))
+                    offset += len(data)
+                pack.flush()
+                os.fsync(pack.fileno())
+            with open(self.index_path, 'a', encoding='utf-8') as index:
+                index.writelines(f"{match_id}\t{offset}\t{length}\n" for match_id, (offset, length) in entries.items())
+            self._index.update(entries)
+        return len(entries)
+
+    def get(self, match_id):
+        """ Return the payload stored for match_id, or None """
+        entry = self._index.get(match_id)
+        if entry is None:
+            return None
+        offset, length = entry
+        with open(self.pack_path, 'rb') as pack:
+            pack.seek(offset)
+            return json.loads(zlib.decompress(pack.read(length)))
+
+    def items(self):
+        """ Iterate over (match_id, payload) in the order they were stored """
+        entries = sorted(self._index.items(), key=lambda x: x[1][0])
+        if not entries:
+            return
+        with open(self.pack_path, 'rb') as pack:
+            for match_id, (offset, length) in entries:
+                pack.seek(offset)
+                yield match_id, json.loads(zlib.decompress(pack.read(length)))
@@ -0,0 +1,163 @@
+import logging
+from datetime import datetime
+from sqlalchemy import Table, MetaData, Column, Index, Integer, BigInteger, Boolean, String, DateTime, select, text
+from sqlalchemy.exc import SQLAlchemyError
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Kept apart from the models metadata: it is managed here, never by create_all/drop_all
+schema_version = Table('schema_version', MetaData(),
+                       Column('version', Integer, primary_key=True),
+                       Column('description', String(200)),
+                       Column('applied_at', DateTime, default=datetime.utcnow))
+
+# (version, description, function(conn)), in the order they must be applied
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """ Register a migration. Migrations must be idempotent: a failed one is run again entirely """
+    def register(func):
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return register
+
+
+def current_version(conn):
+    schema_version.create(conn, checkfirst=True)
+    versions = [r[0] for r in conn.execute(select(schema_version.c.version))]
+    return max(versions) if versions else 0
+
+
+def run_migrations(engine, fresh=False):
+    """
+    Bring an existing database up to the latest schema version, one transaction per migration.
+    A fresh database, just built by create_all from the current models, is only stamped.
+    """
+    with engine.begin() as conn:
+        version = current_version(conn)
+        if fresh:
+            for v, description, _ in MIGRATIONS:
+                if v > version:
+                    conn.execute(schema_version.insert().values(version=v, description=description))
+            return
+
+    for v, description, func in MIGRATIONS:
+        if v <= version:
+            continue
+        logger.info(f"Applying migration {v}: {description}")
+        try:
+            with engine.begin() as conn:
+                func(conn)
+                conn.execute(schema_version.insert().values(version=v, description=description))
+        except SQLAlchemyError as e:
+            logger.error(f"Migration {v} failed, database left at version {version}: {e}")
+            raise
+        version = v
+
+
+def rebuild_table(conn, name, types=None, new_columns=None, expressions=None):
+    """
+    Rebuild a SQLite table to change column types, since SQLite has no ALTER COLUMN.
+      types: column name -> new SQLAlchemy type
+      new_columns: extra Column objects to add
+      expressions: column name -> SQL expression on the old table filling it (default: the old column)
+    Rows, primary keys and indexes are kept.
+    """
+    types, new_columns, expressions = types or {}, new_columns or [], expressions or {}
+    old = Table(name, MetaData(), autoload_with=conn)
+    indexes = [(i.name, [c.name for c in i.columns], i.unique) for i in old.indexes]
+
+    new = Table(name, MetaData(),
+                *[Column(c.name, types.get(c.name, c.type), primary_key=c.primary_key, nullable=c.nullable)
+                  for c in old.columns],
+                *new_columns)
+    for index_name, columns, unique in indexes:
+        Index(index_name, *[new.c[c] for c in columns], unique=unique)
+
+    for index_name, _, _ in indexes:
+        conn.execute(text(f'DROP INDEX "{index_name}"'))
+    conn.execute(text(f'ALTER TABLE "{name}" RENAME TO "{name}_old"'))
+    new.create(conn)
+    columns = [c.name for c in new.columns]
+    column_list = ", ".join('"' + c + '"' for c in columns)
+    select_list = ", ".join(expressions.get(c, '"' + c + '"') for c in columns)
+    conn.execute(text(f'INSERT INTO "{name}" ({column_list}) SELECT {select_list} FROM "{name}_old"'))
+    conn.execute(text(f'DROP TABLE "{name}_old"'))
+
+
+# --- Migrations ---
+
+@migration(1, "unique (gameId, puuid) on game_participants and (gameId, teamId) on game_team")
+def add_unique_indexes(conn):
+    for table, name, columns in (('game_participants', 'uq_participant_game_puuid', '"gameId", puuid'),
+                                 ('game_team', 'uq_team_game_team', '"gameId", "teamId"')):
+        deleted = conn.execute(text(f'DELETE FROM {table} WHERE id NOT IN '
+                                    f'(SELECT MIN(id) FROM {table} GROUP BY {columns})')).rowcount
+        if deleted:
+            logger.warning(f"Removed {deleted} duplicated rows from {table}")
+        conn.execute(text(f'CREATE UNIQUE INDEX IF NOT EXISTS {name} ON {table} ({columns})'))
+
+
+@migration(2, "composite indexes of the dashboard and lane opponent queries")
+def add_query_indexes(conn):
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_participant_puuid_status_end '
+                      'ON game_participants (puuid, "gameStatusProcess", "gameEndTimestamp")'))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_participant_game_team_position '
+                      'ON game_participants ("gameId", "teamId", "individualPosition")'))
+
+
+# game_team.win used to hold "True"/"False" (stored as "1"/"0" by SQLite) or "Remake"
+WIN_VALUES = "('1', 'true', 't', 'yes', 'y', 'win')"
+
+
+@migration(3, "integer timestamps and durations, boolean win and remake flags")
+def use_native_types(conn):
+    if conn.dialect.name == 'sqlite':
+        rebuild_table(conn, 'game_participants',
+                      types={'gameEndTimestamp': BigInteger(), 'gameDuration': Integer()},
+                      expressions={'gameEndTimestamp': 'CAST("gameEndTimestamp" AS INTEGER)',
+                                   'gameDuration': 'CAST("gameDuration" AS INTEGER)'})
+        rebuild_table(conn, 'game_team',
+                      types={'win': Boolean()},
+                      new_columns=[Column('remake', Boolean)],
+                      expressions={'win': f'LOWER(win) IN {WIN_VALUES}',
+                                   'remake': "win = 'Remake'"})
+    else:
+        conn.execute(text('ALTER TABLE game_participants '
+                          'ALTER COLUMN "gameEndTimestamp" TYPE BIGINT USING NULLIF("gameEndTimestamp", \'\')::bigint, '
+                          'ALTER COLUMN "gameDuration" TYPE INTEGER USING NULLIF("gameDuration", \'\')::integer'))
+        conn.execute(text('ALTER TABLE game_team ADD COLUMN remake BOOLEAN'))
+        conn.execute(text("UPDATE game_team SET remake = (win = 'Remake')"))
+        conn.execute(text(f'ALTER TABLE game_team ALTER COLUMN win TYPE BOOLEAN USING (LOWER(win) IN {WIN_VALUES})'))
+
+
+@migration(4, "match list keyset index, without the gameId indexes duplicated by the unique ones")
+def refine_indexes(conn):
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_participant_puuid_status_end_game '
+                      'ON game_participants (puuid, "gameStatusProcess", "gameEndTimestamp", "gameId")'))
+    # prefixes of other indexes, they only slow the inserts down
+    for name in ('ix_participant_puuid_status_end', 'ix_game_participants_gameId', 'ix_game_team_gameId'):
+        conn.execute(text(f'DROP INDEX IF EXISTS "{name}"'))
+
+
+@migration(5, "split game_participants into game_participant_core and game_participant_detail")
+def split_participants(conn):
+    """
+    The new tables are created empty by create_all before the migrations run,
+    and the game_participants view replacing the table is created after them.
+    """
+    old = Table('game_participants', MetaData(), autoload_with=conn)
+    for name, key in (('game_participant_core', 'id'), ('game_participant_detail', 'participant_id')):
+        new = Table(name, MetaData(), autoload_with=conn)
+        columns = [c.name for c in new.columns if c.name == key or c.name in old.columns]
+        column_list = ", ".join('"' + c + '"' for c in columns)
+        select_list = ", ".join('id' if c == key else '"' + c + '"' for c in columns)
+        conn.execute(text(f'INSERT INTO {name} ({column_list}) SELECT {select_list} FROM game_participants'))
+    conn.execute(text('DROP TABLE game_participants'))
+    if conn.dialect.name == 'postgresql':
+        # the ids were copied: the next ones must come after them
+        conn.execute(text("SELECT setval(pg_get_serial_sequence('game_participant_core', 'id'), "
+                          "COALESCE(MAX(id), 0) + 1, false) FROM game_participant_core"))
@@ -0,0 +1,135 @@
+import logging
+import queue
+import threading
+from collections import deque
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Marks the end of the stream in a queue
+_DONE = object()
+
+
+class FairQueue:
+    """
+    Items of several owners (e.g. the games of several accounts), handed out round-robin between the owners
+    and in order for each owner, so that an owner with a long backlog does not hold up the others.
+    """
+
+    def __init__(self):
+        self._items = {}
+        self._turns = deque()
+        self._lock = threading.Lock()
+
+    def put(self, owner, item):
+        with self._lock:
+            if owner not in self._items:
+                self._items[owner] = deque()
+                self._turns.append(owner)
+            self._items[owner].append(item)
+
+    def get(self):
+        """ Next item, or _DONE once every item was handed out """
+        with self._lock:
+            if not self._turns:
+                return _DONE
+            owner = self._turns.popleft()
+            items = self._items[owner]
+            item = items.popleft()
+            if items:
+                self._turns.append(owner)
+            else:
+                del self._items[owner]
+            return item
+
+
+def _fetch_stage(source, cure_queues, func):
+    """ Apply func to the items of source and push the results to the queue of their cure lane """
+    while True:
+        entry = source.get()
+        if entry is _DONE:
+            return
+        cure_lane, item = entry
+        try:
+            result = func(item)
+        except Exception as e:
+            logger.error(f"fetch stage failed on {item}: {e}")
+            result = None
+        if result is not None:
+            cure_queues[cure_lane].put(result)
+
+
+def _stage(name, in_q, out_q, func):
+    """ Apply func to every item of in_q and push the results to out_q until _DONE is received """
+    while True:
+        item = in_q.get()
+        if item is _DONE:
+            return
+        try:
+            result = func(item)
+        except Exception as e:
+            logger.error(f"{name} stage failed on {item}: {e}")
+            result = None
+        if result is not None:
+            out_q.put(result)
+
+
+def _close_after(threads, out_qs, nb_sentinels):
+    """ Wait for every thread of a stage, then tell the next stage that nothing more is coming """
+    for t in threads:
+        t.join()
+    for out_q in out_qs:
+        for _ in range(nb_sentinels):
+            out_q.put(_DONE)
+
+
+def run_pipeline(items, fetch, cure, write, fetch_workers=4, cure_workers=4, queue_size=32, lanes=None):
+    """
+    Run items through three stages joined by bounded queues:
+      - fetch: a pool of fetch_workers threads per fetch lane (I/O bound, they share the rate limiter of their host)
+      - cure: a pool of cure_workers threads per cure lane (it also makes rank requests)
+      - write: a single writer, run in the calling thread, so the database only has one writer
+
+    lanes: optional function item -> (fetch_lane, cure_lane, owner), e.g. the Riot hosts the item is fetched
+    and cured from, and its account. Every lane has its own workers, so a lane waiting for its rate limit does
+    not hold up the others, and the workers of a fetch lane take its items round-robin between their owners.
+    Without it, every item goes through a single lane, in order.
+
+    A stage returning None drops the item. Since the queues between the stages are bounded, the memory
+    used does not depend on the number of items.
+
+    Returns the number of items written.
+    """
+    lanes = lanes or (lambda item: (None, None, None))
+    sources = {}
+    fetched_qs = {}
+    for item in items:
+        fetch_lane, cure_lane, owner = lanes(item)
+        sources.setdefault(fetch_lane, FairQueue()).put(owner, (cure_lane, item))
+        if cure_lane not in fetched_qs:
+            fetched_qs[cure_lane] = queue.Queue(maxsize=queue_size)
+    cured_q = queue.Queue(maxsize=queue_size)
+
+    fetchers = [threading.Thread(target=_fetch_stage, args=(source, fetched_qs, fetch), daemon=True)
+                for source in sources.values() for _ in range(fetch_workers)]
+    curers = [threading.Thread(target=_stage, args=("cure", fetched_q, cured_q, cure), daemon=True)
+              for fetched_q in fetched_qs.values() for _ in range(cure_workers)]
+    helpers = [
+        threading.Thread(target=_close_after, args=(fetchers, list(fetched_qs.values()), cure_workers), daemon=True),
+        threading.Thread(target=_close_after, args=(curers, [cured_q], 1), daemon=True),
+    ]
+    for t in fetchers + curers + helpers:
+        t.start()
+
+    written = 0
+    while True:
+        item = cured_q.get()
+        if item is _DONE:
+            break
+        try:
+            write(item)
+            written += 1
+        except Exception as e:
+            logger.error(f"write stage failed: {e}")
+
+    return written
@@ -0,0 +1,64 @@
+import json
+import queue
+import threading
+
+# Snapshot returned before the first update of the server
+IDLE = {'status': 'idle', 'percent': 100, 'message': 'No update in progress'}
+
+
+class ProgressChannel:
+    """
+    In-memory publish/subscribe channel for the progress of the database update.
+    Every subscriber gets its own bounded queue: a slow client loses intermediate
+    events rather than slowing down the publisher, and always gets the latest one.
+    """
+
+    def __init__(self, max_pending=100):
+        self.max_pending = max_pending
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self.latest = dict(IDLE)
+
+    def publish(self, event):
+        with self._lock:
+            self.latest = event
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                # drop the oldest event to make room for the newest
+                try:
+                    q.get_nowait()
+                except queue.Empty:
+                    pass
+                try:
+                    q.put_nowait(event)
+                except queue.Full:
+                    pass
+
+    def subscribe(self):
+        q = queue.Queue(maxsize=self.max_pending)
+        with self._lock:
+            self._subscribers.add(q)
+            q.put_nowait(self.latest)
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def stream(self, heartbeat=15):
+        """ Generator of Server-Sent Events, starting with the latest event """
+        q = self.subscribe()
+        try:
+            while True:
+                try:
+                    event = q.get(timeout=heartbeat)
+                except queue.Empty:
+                    # SSE comment, keeps the connection open through proxies
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"data: {json.dumps(event)}\n\n"
+        finally:
+            self.unsubscribe(q)
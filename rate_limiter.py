@@ -0,0 +1,149 @@
+import logging
+import threading
+import time
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Limits of a development key. They are only used until the first response
+# tells us the real limits of the key through the X-App-Rate-Limit header.
+DEFAULT_APP_LIMITS = "20:1,100:120"
+
+
+def parse_rate_header(value):
+    """ Parse a Riot rate header such as "20:1,100:120" into [(20, 1), (100, 120)] """
+    pairs = []
+    if not value:
+        return pairs
+    for chunk in value.split(','):
+        try:
+            first, second = chunk.strip().split(':')
+            pairs.append((int(first), int(second)))
+        except ValueError:
+            logger.warning(f"Malformed rate limit header: {value}")
+    return pairs
+
+
+class RateWindow:
+    """ One window of a Riot rate limit, e.g. 100 requests every 120 seconds """
+
+    def __init__(self, limit, seconds):
+        self.limit = limit
+        self.seconds = seconds
+        self.count = 0
+        self.reset_at = 0.0
+
+    def wait_time(self, now):
+        if now >= self.reset_at or self.count < self.limit:
+            return 0.0
+        return self.reset_at - now
+
+    def consume(self, now):
+        if now >= self.reset_at:
+            self.count = 0
+            self.reset_at = now + self.seconds
+        self.count += 1
+
+    def sync(self, count, now):
+        # The count sent back by Riot is authoritative, but it can lag behind
+        # the requests we already sent in parallel, so we never lower ours
+        if now >= self.reset_at:
+            self.reset_at = now + self.seconds
+            self.count = count
+        else:
+            self.count = max(self.count, count)
+
+
+class RateBucket:
+    """ All the windows of one rate limit (the app limit, or the limit of one method) """
+
+    def __init__(self, limits=None):
+        self.windows = {seconds: RateWindow(limit, seconds) for limit, seconds in (limits or [])}
+        self.blocked_until = 0.0
+
+    def wait_time(self, now):
+        waits = [w.wait_time(now) for w in self.windows.values()]
+        waits.append(max(0.0, self.blocked_until - now))
+        return max(waits)
+
+    def consume(self, now):
+        for window in self.windows.values():
+            window.consume(now)
+
+    def update(self, limit_header, count_header, now):
+        limits = parse_rate_header(limit_header)
+        if limits:
+            windows = {}
+            for limit, seconds in limits:
+                window = self.windows.get(seconds) or RateWindow(limit, seconds)
+                window.limit = limit
+                windows[seconds] = window
+            self.windows = windows
+
+        for count, seconds in parse_rate_header(count_header):
+            if seconds in self.windows:
+                self.windows[seconds].sync(count, now)
+
+    def block(self, seconds, now):
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+
+class RateLimiter:
+    """
+    Client side limiter for one host of the RIOT API (europe, euw1, na1, ...).
+
+    On each routing host, Riot enforces an application limit (shared by every call made with the key)
+    and a separate limit for each method (account, match ids, match, league entries).
+    Both are learned from the response headers, and acquire() only blocks when one
+    of the windows is actually exhausted.
+    """
+
+    def __init__(self, app_limits=DEFAULT_APP_LIMITS):
+        self._lock = threading.Lock()
+        self.app = RateBucket(parse_rate_header(app_limits))
+        # Method limits are unknown until the first response of each method
+        self.methods = {}
+
+    def _buckets(self, method):
+        if method not in self.methods:
+            self.methods[method] = RateBucket()
+        return [self.app, self.methods[method]]
+
+    def acquire(self, method):
+        """ Block until a request on `method` fits in every window, then reserve it """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                buckets = self._buckets(method)
+                wait = max(b.wait_time(now) for b in buckets)
+                if wait <= 0:
+                    for b in buckets:
+                        b.consume(now)
+                    return
+            logger.debug(f"Rate limit reached for {method}, waiting {wait:.2f}s")
+            time.sleep(wait)
+
+    def update(self, method, headers):
+        """ Learn limits and current counts from the headers of a response """
+        with self._lock:
+            now = time.monotonic()
+            self.app.update(headers.get('X-App-Rate-Limit'), headers.get('X-App-Rate-Limit-Count'), now)
+            _, method_bucket = self._buckets(method)
+            method_bucket.update(headers.get('X-Method-Rate-Limit'), headers.get('X-Method-Rate-Limit-Count'), now)
+
+    def penalize(self, method, headers):
+        """ Handle a 429: block the bucket Riot blamed for the time it asked us to wait """
+        try:
+            retry_after = float(headers.get('Retry-After', 1))
+        except ValueError:
+            retry_after = 1.0
+        limit_type = headers.get('X-Rate-Limit-Type', 'application')
+        with self._lock:
+            now = time.monotonic()
+            app_bucket, method_bucket = self._buckets(method)
+            if limit_type == 'application':
+                app_bucket.block(retry_after, now)
+            else:
+                # "method" and "service" limits only concern this method
+                method_bucket.block(retry_after, now)
+        return retry_after
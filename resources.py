@@ -0,0 +1,77 @@
+import logging
+import threading
+from config import Config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class Resources:
+    """
+    Resources shared by every module of a process, built once:
+      - settings: snapshot of the lol.ini sections read at startup
+      - db: the DatabaseManager, i.e. one engine and one bounded connection pool
+      - api: the APIHandler, i.e. one HTTP session pool and one rate limiter per RIOT host
+    The user config (config.ini) is not part of the snapshot: the dashboard edits it at runtime.
+    An ingest worker process has its own Resources.
+    """
+
+    def __init__(self, config=None):
+        self.config = config or Config()
+        self.settings = {
+            'database': self.config.read_database_config(),
+            'rank_cache': self.config.read_rank_cache_config(),
+            'http': self.config.read_http_config(),
+            'ingest': self.config.read_ingest_config(),
+            'response_cache': self.config.read_response_cache_config(),
+        }
+        self._db = None
+        self._api = None
+        self._lock = threading.Lock()
+
+    @property
+    def db(self):
+        with self._lock:
+            if self._db is None:
+                # imported here, so that importing the registry does not import the models
+                from database import DatabaseManager
+                self._db = DatabaseManager(**self.settings['rank_cache'], **self.settings['database'])
+            return self._db
+
+    @property
+    def api(self):
+        with self._lock:
+            if self._api is None:
+                from api_handler import APIHandler
+                self._api = APIHandler(self.settings['http'])
+            return self._api
+
+    def close(self):
+        """ Close the HTTP sessions and the pooled database connections """
+        with self._lock:
+            if self._api is not None:
+                self._api.close()
+            if self._db is not None:
+                self._db.engine.dispose()
+
+
+_resources = None
+_resources_lock = threading.Lock()
+
+
+def get_resources():
+    """ The Resources of the process, built at the first call """
+    global _resources
+    with _resources_lock:
+        if _resources is None:
+            _resources = Resources()
+        return _resources
+
+
+def close_resources():
+    """ Close the Resources of the process; the next get_resources() builds new ones (e.g. after a chdir) """
+    global _resources
+    with _resources_lock:
+        if _resources is not None:
+            _resources.close()
+        _resources = None
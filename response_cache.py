@@ -0,0 +1,44 @@
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+
+# A rendered response body, its mimetype and its ETag
+CachedResponse = namedtuple('CachedResponse', ['body', 'mimetype', 'etag'])
+
+
+class ResponseCache:
+    """
+    Thread safe LRU of rendered API responses.
+    Keys must include the data version they were computed from: entries of an older
+    version are never invalidated explicitly, they are just not looked up anymore and
+    get evicted by the newer ones.
+    """
+
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, body, mimetype):
+        """ Store a response body. Returns its CachedResponse, whose ETag is a hash of the body """
+        entry = CachedResponse(body, mimetype, hashlib.sha1(body).hexdigest())
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -1,5 +1,6 @@
 let currentPuuid = null;
 let matchesOffset = 0;
+let matchesCursor = null;
 let matchesLimit = 8;
 let totalMatches = 0;
 let roleChart = null;
@@ -220,23 +221,21 @@ function pollingDB() {
   const updateMessageBox = document.getElementById('update-box');
   const updateTextEl = document.getElementById('update-text');
   updateMessageBox.style.display = "block";
-  
-  const interval = setInterval(async () => {
-    try {
-      const res = await fetch('/api/update-progress');
-      if (!res.ok) return;
 
-      const data = await res.json();
-      updateTextEl.textContent = data.message;
+  // Progress is pushed by the server (Server-Sent Events)
+  const source = new EventSource('/api/update-stream');
+  source.onmessage = (e) => {
+    const data = JSON.parse(e.data);
+    updateTextEl.textContent = data.message;
 
-      if (data.percent >= 100) {
-        clearInterval(interval);
-        setTimeout(() => location.reload(), 2000);
-      }
-    } catch (err) {
-      console.error('Erreur polling progress:', err);
+    if (['done', 'failed', 'cancelled'].includes(data.status)) {
+      source.close();
+      setTimeout(() => location.reload(), 2000);
     }
-  }, 1500);
+  };
+  source.onerror = (err) => {
+    console.error('Erreur stream progress:', err);
+  };
 }
 
 async function startDbUpdate() {
@@ -246,10 +245,10 @@ async function startDbUpdate() {
   updateTextEl.textContent = 'Update in progress ...';
 
   try {
-    // Lance l'update en arrière-plan
-    fetch('/api/database/update', { method: 'POST' });
+    // Lance l'update en arrière-plan (la requête rend la main dès que le job est en file)
+    await fetch('/api/database/update', { method: 'POST' });
 
-    // Polling du progress
+    // Suivi du progress
     pollingDB();
     
   } catch (err) {
@@ -486,7 +485,7 @@ async function refresh() {
       if (!res.ok) return;
 
       const data = await res.json();
-      if (data.percent != 100) {
+      if (data.status === 'queued' || data.status === 'running') {
         pollingDB();
       }
     } catch (err) {
@@ -751,11 +750,13 @@ function drawOpponentEloDistribution(opponents) {
       let rank = parts[0].toUpperCase();
       let division = parts[1].toUpperCase();
 
+      // Chaque entrée regroupe `count` parties contre ce rang
+      const games = opp.count || 1;
       if (rank === 'MASTER') {
-        countMap['MASTER']++;
+        countMap['MASTER'] += games;
       } else if (ranks.includes(rank) && divisions.includes(division)) {
         const key = `${rank} ${division}`;
-        countMap[key]++;
+        countMap[key] += games;
       }
     }
   });
@@ -923,15 +924,21 @@ function drawOpponentEloDistribution(opponents) {
 async function loadMoreMatches(reset = false) {
   if (reset) {
     matchesOffset = 0;
+    matchesCursor = null;
     document.getElementById('matches-list').innerHTML = '';
   }
 
   try {
+    // Les pages suivantes repartent du curseur de la précédente, sans recompter le total
+    const page = matchesCursor ? `cursor=${encodeURIComponent(matchesCursor)}&total=false` : `offset=${matchesOffset}`;
     const response = await fetchJSON(
-      `/api/matches?puuid=${currentPuuid}&limit=${matchesLimit}&offset=${matchesOffset}&gameMode=${matchesGameModeFilter}&role=${matchesRoleFilter}`
+      `/api/matches?puuid=${currentPuuid}&limit=${matchesLimit}&${page}&gameMode=${matchesGameModeFilter}&role=${matchesRoleFilter}`
     );
     const matches = response.matches;
-    totalMatches = response.total;
+    if (response.total !== null) {
+      totalMatches = response.total;
+    }
+    matchesCursor = response.next_cursor;
 
     const container = document.getElementById('matches-list');
 
@@ -1048,7 +1055,7 @@ async function loadMoreMatches(reset = false) {
 
     // Update load more button
     const loadMoreBtn = document.getElementById('load-more-btn');
-    if (matchesOffset >= totalMatches) {
+    if (!matchesCursor || matchesOffset >= totalMatches) {
       loadMoreBtn.style.display = 'none';
     } else {
       loadMoreBtn.style.display = 'block';
@@ -1582,10 +1589,10 @@ async function showMatchDetails(gameId) {
           <img src="static/assets/objectives/tower.png" class="img-objectives">
           <p>${blueTeam.tower || 0}</p>
         </div>
-        <h3>Blue team ${blueTeam.win === '1' ? '(Victory)' : '(Defeat)'}</h3>
+        <h3>Blue team ${blueTeam.win ? '(Victory)' : '(Defeat)'}</h3>
       </div>
       <div class="team-stats-red">
-        <h3>Red team ${redTeam.win === '1' ? '(Victory)' : '(Defeat)'}</h3>
+        <h3>Red team ${redTeam.win ? '(Victory)' : '(Defeat)'}</h3>
         <div class="objectives">
           <img src="static/assets/objectives/tower.png" class="img-objectives">
           <p>${redTeam.tower || 0}</p>
@@ -5,19 +5,25 @@ Created on Sat May 25 12:15:17 2024
 @author: benjamin_arrondeau (@arrondeb)
 """
 
-from api_handler import APIHandler
-from database import DatabaseManager
 import logging
 import pprint
 from datetime import datetime
-from config import Config
+from resources import get_resources
+from config import account_key
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
 from tqdm import tqdm
-import json
+from pipeline import run_pipeline
+from match_store import MatchStore
+import argparse
+import os
+import threading
+import time
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def estimate_time_to_fill_db(games):
+def estimate_time_to_fill_db(games, hosts=1):
 
     # There is 1 request per game fetched
     # There are, at maximum, 9 requests per game to get participants rank
@@ -25,110 +31,364 @@ def estimate_time_to_fill_db(games):
     total_nb_requests = 10 * len(games)
     # There are a maximum of 100 requests every 2 minutes
     # 100 requetes every 2 minutes
-    approx_time = (total_nb_requests / 100) * 2
+    # ... on each routing host, and the games are spread over the hosts
+    approx_time = (total_nb_requests / 100) * 2 / max(1, hosts)
     logger.info(f"=== Task 2: Approx. time to fill the database {approx_time} min. ===")
     return approx_time
 
 
-def main():
+class IngestProgress:
+    """ Build the progress events of an update: percent, ETA, games done and time spent per stage """
+
+    def __init__(self, publish, total, hosts=1):
+        self.publish = publish or (lambda event: None)
+        self.total = total
+        self.hosts = hosts
+        self.done = 0
+        self.started = time.monotonic()
+        self.stage_time = {'fetch': 0.0, 'cure': 0.0, 'write': 0.0}
+        self.stage_count = {'fetch': 0, 'cure': 0, 'write': 0}
+        self._lock = threading.Lock()
+
+    def timed(self, stage, func):
+        """ Wrap a stage function to measure the time spent in it """
+        def wrapper(item):
+            start = time.monotonic()
+            try:
+                return func(item)
+            finally:
+                with self._lock:
+                    self.stage_time[stage] += time.monotonic() - start
+                    self.stage_count[stage] += 1
+        return wrapper
+
+    def eta(self):
+        if self.done == 0:
+            # nothing measured yet, use the theoretical rate limit
+            return estimate_time_to_fill_db(range(self.total), self.hosts) * 60
+        elapsed = time.monotonic() - self.started
+        return elapsed / self.done * (self.total - self.done)
+
+    def update(self, done):
+        self.done = done
+        percent = round((done / self.total) * 100, 1) if self.total else 100
+        eta = self.eta()
+        with self._lock:
+            timings = {stage: round(self.stage_time[stage] / self.stage_count[stage], 3)
+                       for stage in self.stage_time if self.stage_count[stage]}
+        self.publish({
+            "status": "running",
+            "percent": percent,
+            "eta": round(eta),
+            "games_done": done,
+            "games_total": self.total,
+            "stage_timings": timings,
+            "message": f"Update in progress ... {round(eta / 60, 1)} min left ({percent}%)"
+        })
+
+
+def cure_game(game_id, game_json, summoner, user_config, url_config, useful_data, api, db, ranks=None):
+    """ Turn a raw match payload into the participants and teams rows to insert """
+    additional_info = {
+        "game_id": game_id,
+        "game_timestamp": game_json["info"]["gameEndTimestamp"],
+        "game_duration": game_json["info"]["gameDuration"],
+        "game_mode": game_json["info"]["queueId"],
+        "remake_status": game_json["info"]["participants"][0]["gameEndedInEarlySurrender"],
+        "game_version": game_json["info"]["gameVersion"]
+    }
+
+    participants = db.cure_participants_data(game_json["info"]["participants"], additional_info, summoner, user_config, url_config, useful_data, api, ranks)
+
+    teams = []
+    if len(game_json["info"]["teams"]) == 2:
+        teams.append(db.cure_team_data(game_json["info"], useful_data, 0, game_id))
+        teams.append(db.cure_team_data(game_json["info"], useful_data, 1, game_id))
+
+    return {"game_id": game_id, "raw": game_json, "participants": participants, "teams": teams}
+
+
+def store_games(store, games):
+    """ Keep the whole payloads with the ranks resolved at ingest time, so they can be replayed offline """
+    store.put_many((game["game_id"], {"match": game["raw"], "ranks": {p["puuid"]: p["current_rank"] for p in game["participants"]}})
+                   for game in games)
+
+
+def replay(force=False):
+    """
+    Rebuild game_participants and game_team from the raw match store, without any API call.
+    Useful after a change of [USEFUL_DATA] or of the tables columns.
+    """
+    resources = get_resources()
+    useful_data = resources.config.read_useful_config()
+    ingest_config = resources.settings['ingest']
+
+    db = resources.db
+    db.create_tables()
+    store = MatchStore()
+
+    summoners = db.fetch_data('summoner', '*')
+    if not summoners:
+        logger.error("No summoner in database, nothing to replay.")
+        return 0
+    summoner = summoners[0]
+
+    stored_games = {game_id for s in summoners
+                    for (game_id,) in db.iter_data('game_participants', ['gameId'], filters={'puuid': s['puuid']})}
+    missing = [g for g in stored_games if g not in store]
+    if missing and not force:
+        logger.error(f"{len(missing)} games of the database are not in the match store and would be lost. "
+                     f"Run with --force to replay anyway.")
+        return 0
+
+    db.reset_game_tables()
+    written = 0
+    batch = []
+    for game_id, payload in tqdm(store.items(), total=len(store), desc="Replaying games", unit="game"):
+        batch.append(cure_game(game_id, payload["match"], summoner, None, None, useful_data, None, db, ranks=payload["ranks"]))
+        if len(batch) >= ingest_config['write_batch_size']:
+            written += db.insert_games(batch)
+            batch = []
+    written += db.insert_games(batch)
+    db.checkpoint('TRUNCATE')
+
+    logger.info(f"Replayed {written} games from the match store")
+    return written
+
+
+def rebuild_rollups():
+    """ Recompute the per-summoner rollup tables from the game tables, e.g. after editing games by hand """
+    db = get_resources().db
+    db.create_tables()
+    return db.rebuild_rollups()
+
+
+def sync_summoner(account, url_config, api, db):
+    """ The summoner row of an account, fetched from the API and stored the first time """
+    summoners = db.fetch_data('summoner', '*', filters={'summoner_name': account['gameName'], 'summoner_tag': account['tagLine']})
+    if summoners:
+        return summoners[0]
+
+    api.test_api_connection(account, url_config)
+    account_puiid = api.fetch_puuid(account, url_config)
+    # the account may be stored under another spelling of its name
+    summoners = db.fetch_data('summoner', '*', filters={'puuid': account_puiid})
+    if summoners:
+        return summoners[0]
+
+    summoner = {
+        "summoner_name": account['gameName'],
+        "summoner_tag": account['tagLine'],
+        "puuid": account_puiid,
+        "current_rank": api.fetch_summoner_rank(url_config, account, account_puiid)
+    }
+    db.insert_summoner(summoner)
+    return summoner
+
+
+def list_new_games(account, url_config, summoner, api, db, full_sync=False):
+    """ Ids of the games of the summoner that are not stored yet, the newest first. None if the listing is incomplete """
+    account_puiid = summoner['puuid']
+    # Without a cursor (first update of the account, or the last one lost games), the whole history is listed:
+    # a game that failed before is older than the newest stored game, an incremental listing would skip it
+    cursor = None if full_sync else db.fetch_sync_cursor(account_puiid)
+    start_time = None
+    is_known = None
+    if cursor is not None:
+        # Incremental sync: only list the games started after the newest game fully synced
+        start_time = cursor // 1000
+        def is_known(ids):
+            not_stored = db.remove_already_stored_games(ids, account_puiid)
+            # when the check fails, keep listing rather than stop early
+            return not_stored is not None and len(not_stored) < len(ids)
+        logger.info(f"Incremental sync of {account_key(account)} from {datetime.fromtimestamp(start_time)}")
+
+    all_games_id = api.fetch_all_matches(url_config, account, summoner, start_time, is_known)
+    if all_games_id is None:
+        return None
+    return db.remove_already_stored_games(all_games_id, account_puiid)
+
+
+def copy_from_sqlite(path=None):
+    """
+    Copy the SQLite database into the database of DATABASE_URL (or [DATABASE] url), e.g. once, when an
+    existing installation moves to the PostgreSQL server of docker-compose.yml
+    """
+    from database import DatabaseManager, SQLITE_PATH
+    path = path or SQLITE_PATH
+    resources = get_resources()
+    db = resources.db
+    if db.engine.dialect.name == 'sqlite':
+        logger.error("Set DATABASE_URL (or [DATABASE] url) to the database to copy the SQLite file into.")
+        return None
+    if not os.path.exists(path):
+        logger.error(f"No SQLite database at {path}")
+        return None
+    source = DatabaseManager(database_url=f'sqlite:///{path}', sqlite_pragmas=resources.settings['database']['sqlite_pragmas'])
+    try:
+        return db.copy_from(source)
+    finally:
+        source.engine.dispose()
+
+
+def main(full_sync=False, progress=None, accounts=None):
+    """
+    Fetch the new games of the tracked accounts and store them.
+    progress: optional callable receiving the progress events (dicts) of the update
+    accounts: optional list of "gameName#tagLine" to update, every account of the config by default
+
+    The games are fetched through one lane per Riot routing host (europe, americas, ...) and cured
+    through one lane per platform host (euw1, na1, ...), each with its own rate limiter, so the
+    accounts of different regions are updated in parallel while the accounts of one host share it.
+    """
+    publish = progress or (lambda event: None)
+
     # Initialisation de la configuration 
-    config = Config()
-    user_config = config.read_user_config()
-    url_config = config.read_url_config()
+    resources = get_resources()
+    config = resources.config
     useful_data = config.read_useful_config()
+    ingest_config = resources.settings['ingest']
+    tracked = config.read_accounts_config()
+    if accounts:
+        wanted = {key.lower() for key in accounts}
+        tracked = [a for a in tracked if account_key(a).lower() in wanted]
+        if len(tracked) < len(wanted):
+            logger.warning(f"Unknown accounts ignored: {sorted(wanted - {account_key(a).lower() for a in tracked})}")
 
     # Initialisation de l'API
-    api = APIHandler()
+    api = resources.api
 
     # Initialisation de la base de données
-    db = DatabaseManager()
+    db = resources.db
     db.create_tables()
+    store = MatchStore()
 
-    with open('progress.json', 'w') as f:
-        json.dump({'percent': 0, 'message': 'Update started ...'}, f)
-    
-    # Task 1: Fetch et save summoner
-    logger.info("=== Step 1: Fetch and Save summoner ===")
-    summoner_existence = db.fetch_main_summoner()
-    
-    if not summoner_existence:
-        api.test_api_connection(user_config, url_config)
-        account_puiid = api.fetch_puuid(user_config, url_config)
-        account_rank = api.fetch_summoner_rank(url_config, user_config, account_puiid)
-        
-        summoner = {
-            "summoner_name": user_config['gameName'],
-            "summoner_tag": user_config['tagLine'],
-            "puuid": account_puiid,
-            "current_rank": account_rank
-        }
-        db.insert_summoner(summoner)
-    else:
-        summoner = db.fetch_data('summoner')[0]
-        account_puiid = summoner['puuid']
+    publish({'status': 'running', 'percent': 0, 'message': 'Update started ...'})
+
+    # Task 1: Fetch and save the summoners, and list their new games. Accounts are independent, one thread each
+    logger.info(f"=== Step 1: Fetch and Save {len(tracked)} summoners ===")
+
+    def prepare(account):
+        try:
+            url_config = config.read_url_config(account['platform'])
+            summoner = sync_summoner(account, url_config, api, db)
+            new_games = list_new_games(account, url_config, summoner, api, db, full_sync)
+        except Exception as e:
+            logger.error(f"Could not list the games of {account_key(account)}, skipping it: {e}")
+            return None
+        if new_games is None:
+            # skipped as a whole, so its cursor stays where it is and the next update lists the games again
+            logger.error(f"Could not list all the games of {account_key(account)}, skipping it")
+            return None
+        logger.info(f"{account_key(account)}: {len(new_games)} new games")
+        return {'account': account, 'url_config': url_config, 'summoner': summoner, 'new_games': new_games}
+
+    with ThreadPoolExecutor(max_workers=max(1, len(tracked))) as pool:
+        prepared = [entry for entry in pool.map(prepare, tracked) if entry is not None]
 
     # Task 2: Fetch et save summoners games participants and teams
     logger.info("=== Task 2: Fetch and Process games participants ===")
-    all_games_id = api.fetch_all_matches(url_config, user_config, summoner)
-    games_id_not_stored_yet = db.remove_already_stored_games(all_games_id, account_puiid)
+    # a game played together by several tracked accounts is only fetched once
+    owners = {}
+    for entry in prepared:
+        for game_id in entry['new_games']:
+            owners.setdefault(game_id, entry)
 
-    if games_id_not_stored_yet == []:
+    if not owners:
         logger.info("No new games to process. Exiting.")
 
-        with open('progress.json', 'w') as f:
-            json.dump({'percent': 100, 'message': 'Update finished'}, f)
-        
     else:
-        logger.info(f"{len(games_id_not_stored_yet)} new games to process.")
-        percent = 0
-        timeLeft = estimate_time_to_fill_db(games_id_not_stored_yet)
-        progress = {
-            "percent": percent,
-            "message": f"Update in progress ... {timeLeft} min left ({percent}%)"
-        }
+        logger.info(f"{len(owners)} new games to process.")
+        host = lambda url: urlsplit(url).netloc
+        lanes = lambda item: (host(item[0]['url_config']['match_base_url']),
+                              host(item[0]['url_config']['league_base_url']),
+                              account_key(item[0]['account']))
+        nb_hosts = len({host(entry['url_config']['match_base_url']) for entry in owners.values()})
+        reporter = IngestProgress(publish, len(owners), nb_hosts)
+        reporter.update(0)
 
-        with open('progress.json', 'w') as f:
-            json.dump(progress, f)
-        
-        for i in tqdm(range(len(games_id_not_stored_yet)), desc="Processing games", unit="game"):
+        def fetch(item):
+            entry, game_id = item
+            game_json = api.fetch_match(entry['url_config'], entry['account'], game_id)
+            if game_json is None:
+                logger.error(f"Could not fetch game {game_id}, skipping it")
+                return None
+            return entry, game_id, game_json
+
+        def cure(fetched):
+            entry, game_id, game_json = fetched
+            return cure_game(game_id, game_json, entry['summoner'], entry['account'], entry['url_config'], useful_data, api, db)
 
-            game_id = games_id_not_stored_yet[i]
-            game_json = api.fetch_match(url_config, user_config, game_id)
+        progress_bar = tqdm(total=len(owners), desc="Processing games", unit="game")
 
-            additional_info = {
-                "game_id": game_id,
-                "game_timestamp": game_json["info"]["gameEndTimestamp"],
-                "game_duration": game_json["info"]["gameDuration"],
-                "game_mode": game_json["info"]["queueId"],
-                "remake_status": game_json["info"]["participants"][0]["gameEndedInEarlySurrender"],
-                "game_version": game_json["info"]["gameVersion"]
-            }
+        batch = []
+        written = 0
+        done = 0
+        batches = 0
 
-            participants = db.cure_participants_data(game_json["info"]["participants"], additional_info, summoner, user_config, url_config, useful_data, api)
-            db.insert_participants(participants)
+        def insert(games):
+            # one fsync of the store per batch, like one transaction of the database per batch
+            store_games(store, games)
+            return db.insert_games(games)
 
-            if len(game_json["info"]["teams"]) == 2:
+        insert = reporter.timed('write', insert)
 
-                team_blue = db.cure_team_data(game_json["info"], useful_data, 0)
-                team_red = db.cure_team_data(game_json["info"], useful_data, 1)
+        def flush():
+            nonlocal batch, written, done, batches
+            written += insert(batch)
+            batches += 1
+            if ingest_config['checkpoint_every_batches'] and batches % ingest_config['checkpoint_every_batches'] == 0:
+                # the autocheckpoint can be starved by the dashboard readers, this keeps the WAL bounded
+                db.checkpoint('PASSIVE')
+            done += len(batch)
+            progress_bar.update(len(batch))
+            batch = []
+            reporter.update(done)
 
-                db.insert_team(team_blue)
-                db.insert_team(team_red)
+        def write(game):
+            # Games are committed by batches, one transaction per batch
+            batch.append(game)
+            if len(batch) >= ingest_config['write_batch_size']:
+                flush()
 
-            percent = round((i / len(games_id_not_stored_yet)) * 100, 1)
-            timeLeft = estimate_time_to_fill_db(games_id_not_stored_yet[i:])
-            progress = {
-                "percent": percent,
-                "message": f"Update in progress ... {timeLeft} min left ({percent}%)"
-            }
+        run_pipeline([(entry, game_id) for game_id, entry in owners.items()],
+                     reporter.timed('fetch', fetch), reporter.timed('cure', cure), write,
+                     fetch_workers=ingest_config['fetch_workers'],
+                     cure_workers=ingest_config['cure_workers'],
+                     queue_size=ingest_config['queue_size'],
+                     lanes=lanes)
+        flush()
+        progress_bar.close()
 
-            with open('progress.json', 'w') as f:
-                json.dump(progress, f)
+        logger.info(f"Inserted {written} games")
+        db.checkpoint('TRUNCATE')
 
-        logger.info(f"Inserted {len(all_games_id)} games")
-        with open('progress.json', 'w') as f:
-            json.dump({'percent': 100, 'message': 'Update finished'}, f)
+    # The cursor only moves once every listed game of the account is stored:
+    # a game that failed is retried at the next update since the cursor stays behind it
+    for entry in prepared:
+        if db.remove_already_stored_games(entry['new_games'], entry['summoner']['puuid']) == []:
+            db.save_sync_cursor(entry['summoner']['puuid'])
+
+    api.close()
+    publish({'status': 'done', 'percent': 100, 'message': 'Update finished'})
         
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description="Fetch the new games of the tracked accounts and store them")
+    parser.add_argument('--replay', action='store_true', help="rebuild the game tables from the raw match store, without any API call")
+    parser.add_argument('--force', action='store_true', help="with --replay, drop the games that are not in the match store")
+    parser.add_argument('--full', action='store_true', help="list the whole match history instead of the games since the last update")
+    parser.add_argument('--copy-from-sqlite', nargs='?', const='', metavar='PATH',
+                        help="copy the SQLite database (.lol_dashboard/lol_data.db by default) into the one of DATABASE_URL")
+    parser.add_argument('--account', action='append', metavar='NAME#TAG', help="only update this account (can be repeated)")
+    parser.add_argument('--rebuild-rollups', action='store_true', help="recompute the statistics tables from the stored games")
+    args = parser.parse_args()
+
+    if args.copy_from_sqlite is not None:
+        copy_from_sqlite(args.copy_from_sqlite)
+    elif args.rebuild_rollups:
+        rebuild_rollups()
+    elif args.replay:
+        replay(force=args.force)
+    else:
+        main(full_sync=args.full, accounts=args.account)